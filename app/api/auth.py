@@ -49,17 +49,11 @@ def update_status(
     current_user: User = Depends(get_current_user)
 ):
     """手动设置用户在线状态"""
-    from datetime import datetime, timedelta
+    from app.services.presence_store import presence_store
     
     new_status = status.get("status")
     if new_status not in ["online", "offline"]:
         raise HTTPException(400, detail="状态必须是 online 或 offline")
     
-    current_user.status = new_status
-    if new_status == "offline":
-        current_user.last_seen = datetime.utcnow() + timedelta(hours=8)
-    else:
-        current_user.last_seen = None
-    
-    db.commit()
+    presence_store.set_status(current_user.id, new_status)
     return {"msg": f"状态已更新为 {new_status}"}
\ No newline at end of file
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends
+from app.core.dependencies import get_current_user
+from app.core.diagnostics import loop_monitor
+from app.models.user import User
+from app.websocket.manager import manager
+from app.websocket.admission import admission
+from app.websocket.dispatcher import dispatcher
+
+router = APIRouter()
+
+
+@router.get("/loop")
+async def get_loop_stats(current_user: User = Depends(get_current_user)):
+    """
+    事件循环健康状况（async：各项统计都属于事件循环，必须在循环线程里读取，不能放到线程池）
+    
+    Returns:
+        - lag_ms: 事件循环延迟（最近一次、p50、p99、最大值）
+        - blocks_by_label: 按路由 / WebSocket 消息类型累计的阻塞次数和时长（需开启 LOOP_BLOCK_DEBUG）
+        - recent_blocks: 最近的阻塞事件及当时的调用栈
+        - websocket: 当前 worker 的在线用户数、通话音频统计和新连接准入统计，
+          推送确认窗口统计（delivery），
+          以及按消息类型统计的处理次数、错误数和耗时分布（messages）
+    """
+    stats = loop_monitor.snapshot()
+    stats["websocket"] = {
+        "online_users": len(manager.active_connections),
+        "relays": manager.get_relay_stats(),
+        "admission": admission.stats(),
+        "delivery": manager.delivery.stats(),
+        "messages": dispatcher.stats()
+    }
+    return stats
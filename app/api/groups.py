@@ -6,7 +6,7 @@ from app.core.dependencies import get_current_user
 from app.models.user import User
 from app.schemas.groups import GroupCreate, GroupUpdate, GroupResponse
 from app.schemas.group_members import GroupMemberRoleUpdate, GroupMemberResponse
-from app.schemas.group_messages import GroupMessageCreate, GroupMessageResponse, GroupMessagePage
+from app.schemas.group_messages import GroupMessageCreate, GroupMessageResponse, GroupMessagePage, GroupMessageReadBy
 from app.services import group_service
 import shutil, uuid, os
 
@@ -311,8 +311,11 @@ async def send_group_message(
 @router.get("/{group_id}/messages", response_model=GroupMessagePage)
 def get_group_messages(
     group_id: int,
-    last_id: Optional[int] = Query(None, description="上次最后一条消息ID，用于分页"),
+    last_id: Optional[int] = Query(None, description="上次最后一条消息ID，用于分页（等同于 before）"),
     limit: int = Query(99, ge=1, le=100, description="每页条数，默认30"),
+    before: Optional[str] = Query(None, description="分页游标，取更早的一页"),
+    after: Optional[str] = Query(None, description="分页游标，取更新的一页"),
+    around: Optional[int] = Query(None, description="消息ID，取以该消息为中心的一页"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -325,11 +328,15 @@ def get_group_messages(
     Query:
         - last_id: 上次最后一条消息ID（可选，用于分页）
         - limit: 每页条数（默认30，最大100）
+        - before / after: 上一页返回的 older_cursor / newer_cursor（可选）
+        - around: 消息ID（可选，搜索结果跳转到消息时使用）
     
     说明：
-        仅群成员可查看
+        仅群成员可查看；before / after / around / last_id 最多指定一个，返回的消息都按从新到旧排列
     """
-    return group_service.get_group_messages(db, group_id, current_user.id, last_id, limit)
+    return group_service.get_group_messages(
+        db, group_id, current_user.id, last_id, limit, before, after, around
+    )
 
 
 @router.get("/{group_id}/messages/unread")
@@ -339,7 +346,7 @@ def get_group_unread_count(
     current_user: User = Depends(get_current_user)
 ):
     """
-    获取群未读消息数
+    获取群未读消息数（最多数到 GROUP_UNREAD_MAX）
     
     Path:
         - group_id: 群组ID
@@ -348,9 +355,34 @@ def get_group_unread_count(
     return {"group_id": group_id, "unread_count": count}
 
 
+@router.get("/{group_id}/messages/read_by", response_model=list[GroupMessageReadBy])
+def get_group_read_by(
+    group_id: int,
+    message_ids: list[int] = Query(..., max_length=100, description="消息ID，可重复传多个（最多100个）"),
+    with_users: bool = Query(False, description="是否返回已读成员列表"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    获取一页群消息的已读人数
+    
+    Path:
+        - group_id: 群组ID
+    
+    Query:
+        - message_ids: 消息ID（如 ?message_ids=1&message_ids=2）
+        - with_users: 是否同时返回已读成员的用户ID
+    
+    说明：
+        仅群成员可查看；成员标记已读后，被读到消息的发送者会收到 group_read_receipt 推送
+    """
+    return group_service.get_group_read_by(db, group_id, current_user.id, message_ids, with_users)
+
+
 @router.post("/{group_id}/messages/read")
 async def mark_group_messages_read(
     group_id: int,
+    message_id: Optional[int] = Query(None, description="读到哪条消息为止，不传则读到最新"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -360,15 +392,21 @@ async def mark_group_messages_read(
     Path:
         - group_id: 群组ID
     
+    Query:
+        - message_id: 读到哪条消息为止（可选）
+    
     说明：
-        前端进入群聊页面时调用此接口，批量标记消息为已读
+        前端进入群聊页面时调用此接口。已读状态按成员记录（已读游标），
+        updated_count 为这次新读的消息数，最多 GROUP_UNREAD_MAX
     """
     try:
-        updated_count = await group_service.mark_group_messages_read(db, group_id, current_user.id)
+        updated_count = await group_service.mark_group_messages_read(db, group_id, current_user.id, message_id)
         return {
             "msg": "标记成功",
             "group_id": group_id,
             "updated_count": updated_count
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(500, detail=f"标记已读失败: {str(e)}")
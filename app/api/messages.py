@@ -59,8 +59,11 @@ async def upload_file(
 @router.get("/history/{peer_user_id}", response_model=Messagepage)
 def get_chat_history(
     peer_user_id: int,
-    last_id: Optional[int] = Query(None, description="上次最后一条消息ID，用于分页"),
+    last_id: Optional[int] = Query(None, description="上次最后一条消息ID，用于分页（等同于 before）"),
     limit: int = Query(99, ge=1, le=100, description="每页条数，默认99"),
+    before: Optional[str] = Query(None, description="分页游标，取更早的一页"),
+    after: Optional[str] = Query(None, description="分页游标，取更新的一页"),
+    around: Optional[int] = Query(None, description="消息ID，取以该消息为中心的一页"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -73,6 +76,10 @@ def get_chat_history(
     Query:
         - last_id: 上次最后一条消息ID（可选，用于分页）
         - limit: 每页条数（默认20，最大100）
+        - before / after: 上一页返回的 older_cursor / newer_cursor（可选）
+        - around: 消息ID（可选，搜索结果跳转到消息时使用）
+    
+    before / after / around / last_id 最多指定一个，返回的消息都按从新到旧排列
     """
     try:
         return message_service.get_chat_history(
@@ -80,8 +87,13 @@ def get_chat_history(
             current_user.id, 
             peer_user_id, 
             last_id, 
-            limit
+            limit,
+            before,
+            after,
+            around
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(500, detail=f"获取聊天历史失败: {str(e)}")
 
@@ -9,6 +9,8 @@ class Settings(BaseSettings):
     DB_USER: str
     DB_PASSWORD: str
     DB_DATABASE: str
+    # 执行同步数据库调用的线程数（与连接池上限 pool_size + max_overflow 一致）
+    DB_EXECUTOR_WORKERS: int = 30
     
     #跨域
     CORS_ORIGINS: str = "http://localhost:3000"
@@ -29,6 +31,66 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    # ---------- WebSocket ----------
+    # 跨 worker 消息总线: local（单 worker）| unix（单机多 worker）
+    WS_BUS_BACKEND: str = "local"
+    WS_BUS_DIR: str = "/tmp/chat_ws_bus"
+    # 每个连接的发送队列上限（帧数）
+    WS_SEND_QUEUE_SIZE: int = 256
+    # 发送队列连续溢出多少次后断开慢客户端
+    WS_LAGGARD_STRIKES: int = 8
+    # 群消息扇出时每入队多少个连接让出一次事件循环
+    WS_FANOUT_CHUNK_SIZE: int = 500
+    # 心跳：周期（秒）、空闲多久视为失效（秒）、时间轮槽数
+    WS_HEARTBEAT_INTERVAL: float = 30.0
+    WS_IDLE_TIMEOUT: float = 90.0
+    WS_HEARTBEAT_SLOTS: int = 60
+    # 通话音频每个方向缓冲的帧数（满了丢最旧的帧）
+    WS_AUDIO_RING_SIZE: int = 32
+    # 批量推送（客户端声明 caps=batch 时启用）：合并窗口（毫秒）、每帧最多合并的事件数
+    WS_BATCH_WINDOW_MS: int = 20
+    WS_BATCH_MAX_EVENTS: int = 64
+    # 重连时离线消息同步：每页最多多少条、一次最多同步多少条（超出部分由客户端查历史记录）
+    WS_SYNC_PAGE_SIZE: int = 200
+    WS_SYNC_MAX_MESSAGES: int = 5000
+    # 新连接准入（令牌桶）：每秒放行多少个、突发上限、排队上限、最长排队时间（秒）
+    WS_ADMIT_RATE: float = 100.0
+    WS_ADMIT_BURST: int = 200
+    WS_ADMIT_QUEUE_SIZE: int = 1000
+    WS_ADMIT_MAX_WAIT: float = 5.0
+    # 被拒绝时建议的重试时间上再叠加的随机抖动（秒），把重连打散
+    WS_ADMIT_RETRY_JITTER: float = 10.0
+    # 断线重连令牌有效期（秒），带有效令牌的重连走优先通道
+    WS_RESUME_TOKEN_TTL: int = 600
+    # 每个设备会话最多保留多少条未确认的推送（断线后保留 WS_RESUME_TOKEN_TTL 秒，重连时重放），
+    # 不应超过 WS_SEND_QUEUE_SIZE，否则重放时会挤爆发送队列
+    WS_ACK_WINDOW: int = 200
+    # 断线后多久仍未重连才视为下线（秒）
+    PRESENCE_GRACE_SECONDS: float = 5.0
+    # 在线状态推送的合并窗口（毫秒）
+    PRESENCE_BATCH_MS: int = 50
+    # 在线状态批量回写数据库的间隔（秒）
+    PRESENCE_FLUSH_INTERVAL: float = 2.0
+
+    # ---------- 诊断 ----------
+    # 事件循环延迟采样间隔（秒）
+    LOOP_LAG_INTERVAL: float = 0.5
+    # 阻塞检测（记录占用事件循环超过阈值的调用栈，有一定开销，排查问题时开启）
+    LOOP_BLOCK_DEBUG: bool = False
+    LOOP_BLOCK_THRESHOLD_MS: int = 100
+
+    # ---------- 缓存 ----------
+    # 群成员缓存：最多缓存多少个群、过期时间（秒）
+    GROUP_MEMBER_CACHE_SIZE: int = 10000
+    GROUP_MEMBER_CACHE_TTL: int = 600
+    # 联系人邻接缓存：最多缓存多少个用户、过期时间（秒）
+    CONTACT_CACHE_SIZE: int = 50000
+    CONTACT_CACHE_TTL: int = 600
+
+    # ---------- 群聊 ----------
+    # 群未读数最多数到多少（超出按上限返回，客户端显示为 “99+” 之类）
+    GROUP_UNREAD_MAX: int = 99
+
     class Config:
         env_file = ".env"
         case_sensitive = True
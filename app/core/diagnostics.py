@@ -0,0 +1,189 @@
+# core/diagnostics.py
+"""事件循环延迟监控与阻塞调用检测
+
+- 延迟采样（始终开启）：后台任务每隔 LOOP_LAG_INTERVAL 秒 sleep 一次，
+  实际醒来时间比预期晚多少就是这段时间里事件循环被占用的程度
+- 阻塞检测（LOOP_BLOCK_DEBUG=true 时开启）：看门狗线程盯着采样任务的心跳，
+  心跳超过 LOOP_BLOCK_THRESHOLD_MS 没有更新，说明有回调长时间占着事件循环，
+  立即抓取事件循环线程的调用栈，并记下当时正在处理的 HTTP 路由 / WebSocket 消息类型
+
+路由和消息类型通过 set_label() 标记到当前 Task 上（HTTP 由 main.py 中的中间件设置，
+WebSocket 由接收循环按消息类型设置），看门狗读取卡住事件循环的那个 Task 的标签。
+结果通过 /api/diagnostics/loop 查看。
+"""
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict
+from app.core.config import settings
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# 当前正在处理的路由 / 消息类型
+current_label: ContextVar[str] = ContextVar("current_label", default="-")
+
+# {Task: 标签}，供看门狗线程读取（其他线程读不到 Task 的 contextvar）
+_task_labels: "weakref.WeakKeyDictionary[asyncio.Task, str]" = weakref.WeakKeyDictionary()
+
+
+def set_label(label: str):
+    """标记当前请求正在处理的路由 / 消息类型（用于阻塞归因）"""
+    current_label.set(label)
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        return
+    if task is not None:
+        _task_labels[task] = label
+
+
+class LoopMonitor:
+    """事件循环延迟采样 + 阻塞看门狗"""
+
+    def __init__(self, interval: float, threshold: float, debug: bool, history: int = 600):
+        self.interval = interval
+        self.threshold = threshold
+        self.debug = debug
+        # 最近的延迟样本（秒）
+        self._samples: deque[float] = deque(maxlen=history)
+        self._max_lag = 0.0
+        self._count = 0
+        # 最近的阻塞事件
+        self._blocks: deque[dict] = deque(maxlen=50)
+        # 按标签累计的阻塞: {label: {"count": 次数, "total_ms": 总时长}}
+        self._by_label: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._beat = time.monotonic()
+        self._task: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stopped = threading.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._sample())
+        if self.debug:
+            self._stopped.clear()
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+            logger.info(f"[diagnostics] 阻塞检测已开启，阈值 {self.threshold * 1000:.0f}ms")
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+        self._stopped.set()
+
+    async def _sample(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._beat = now
+            self._samples.append(lag)
+            self._count += 1
+            self._max_lag = max(self._max_lag, lag)
+
+    # ========== 阻塞看门狗（独立线程） ==========
+
+    def _watch(self):
+        check = min(self.threshold / 2, 0.05)
+        blocked: dict | None = None
+        while not self._stopped.wait(check):
+            stalled = time.monotonic() - self._beat - self.interval
+            if stalled >= self.threshold:
+                if blocked is None:
+                    blocked = self._capture()
+            elif blocked is not None:
+                # 事件循环恢复：记录这次阻塞的总时长
+                self._record(blocked, time.monotonic() - blocked["started"])
+                blocked = None
+
+    def _capture(self) -> dict:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.format_stack(frame) if frame else []
+        return {
+            "started": time.monotonic(),
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "label": self._stalled_label(),
+            "stack": [line.rstrip() for line in stack[-15:]]
+        }
+
+    def _stalled_label(self) -> str:
+        """读取卡住事件循环的 Task 的标签"""
+        task = asyncio.current_task(self._loop)
+        if task is None:
+            return "-"
+        return _task_labels.get(task, task.get_name())
+
+    def _record(self, blocked: dict, elapsed: float):
+        # 阻塞从心跳应到而未到时开始算，加上阈值部分
+        duration_ms = round((elapsed + self.threshold) * 1000, 1)
+        label = blocked["label"]
+        event = {"at": blocked["at"], "label": label, "duration_ms": duration_ms, "stack": blocked["stack"]}
+        with self._lock:
+            self._blocks.append(event)
+            stats = self._by_label.setdefault(label, {"count": 0, "total_ms": 0.0})
+            stats["count"] += 1
+            stats["total_ms"] = round(stats["total_ms"] + duration_ms, 1)
+        logger.warning(f"[diagnostics] 事件循环被阻塞约 {duration_ms}ms，来源: {label}")
+
+    # ========== 查询 ==========
+
+    def snapshot(self) -> dict:
+        samples = sorted(self._samples)
+
+        def pct(p: float) -> float:
+            if not samples:
+                return 0.0
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 2)
+
+        with self._lock:
+            blocks = list(self._blocks)
+            by_label = {k: dict(v) for k, v in self._by_label.items()}
+        return {
+            "lag_ms": {
+                "last": round(self._samples[-1] * 1000, 2) if self._samples else 0.0,
+                "p50": pct(0.5),
+                "p99": pct(0.99),
+                "max": round(self._max_lag * 1000, 2),
+                "samples": self._count,
+                "interval_ms": self.interval * 1000
+            },
+            "block_debug": self.debug,
+            "block_threshold_ms": self.threshold * 1000,
+            "blocks_by_label": by_label,
+            "recent_blocks": blocks
+        }
+
+
+class LabelMiddleware:
+    """ASGI 中间件：把请求的方法和路径写入 current_label"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            set_label(f"{scope['method']} {scope['path']}")
+        elif scope["type"] == "websocket":
+            set_label(f"ws {scope['path']}")
+        await self.app(scope, receive, send)
+
+
+# 全局单例
+loop_monitor = LoopMonitor(
+    interval=settings.LOOP_LAG_INTERVAL,
+    threshold=settings.LOOP_BLOCK_THRESHOLD_MS / 1000,
+    debug=settings.LOOP_BLOCK_DEBUG
+)
@@ -0,0 +1,88 @@
+# core/pagination.py
+"""聊天记录的 keyset 分页
+
+所有模式都按消息 id 排序（id 与发送顺序一致，不受 created_at 相同的影响），
+由 (会话键 / 群 id, id) 复合索引支撑，每页只做一次索引范围扫描：
+
+    - 不带参数: 最新一页
+    - before=游标: 游标之前（更早）的一页
+    - after=游标: 游标之后（更新）的一页
+    - around=消息 id: 以该消息为中心的一页（搜索结果“跳转到消息”），包含该消息本身
+    - last_id=消息 id: 旧参数，等同于 before
+
+游标是不透明字符串，由返回结果中的 older_cursor / newer_cursor 给出；
+无论哪种模式，返回的 items 都按 id 从新到旧排列。
+"""
+from typing import Optional
+from fastapi import HTTPException
+import base64
+
+
+def encode_cursor(message_id: int) -> str:
+    return base64.urlsafe_b64encode(f"m{message_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """解析游标，无效时抛 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        if not raw.startswith("m"):
+            raise ValueError
+        return int(raw[1:])
+    except Exception as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
+def paginate(
+    query,
+    id_column,
+    limit: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    around: Optional[int] = None,
+    last_id: Optional[int] = None
+) -> tuple[list, dict]:
+    """按 keyset 取一页
+
+    Args:
+        query: 已加好会话 / 群过滤条件的 Query
+        id_column: 消息 id 列
+
+    Returns:
+        (按 id 从新到旧的消息, 分页字段 has_more / last_id / has_newer / older_cursor / newer_cursor)
+    """
+    if sum(p is not None for p in (before, after, around, last_id)) > 1:
+        raise HTTPException(400, "before / after / around / last_id 只能指定一个")
+    try:
+        before_id = decode_cursor(before) if before is not None else last_id
+        after_id = decode_cursor(after) if after is not None else None
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    if around is not None:
+        # 中心消息和更早的消息占一半，更新的消息占另一半
+        older_limit = (limit + 1) // 2
+        older = query.filter(id_column <= around).order_by(id_column.desc()).limit(older_limit + 1).all()
+        newer = query.filter(id_column > around).order_by(id_column.asc()).limit(limit - older_limit + 1).all()
+        has_older, has_newer = len(older) > older_limit, len(newer) > limit - older_limit
+        items = newer[:limit - older_limit][::-1] + older[:older_limit]
+    elif after_id is not None:
+        rows = query.filter(id_column > after_id).order_by(id_column.asc()).limit(limit + 1).all()
+        has_older, has_newer = True, len(rows) > limit
+        items = rows[:limit][::-1]
+    else:
+        if before_id:
+            query = query.filter(id_column < before_id)
+        rows = query.order_by(id_column.desc()).limit(limit + 1).all()
+        # 从某条消息往前翻时，游标指向的消息本身就是更新的消息
+        has_older, has_newer = len(rows) > limit, bool(before_id)
+        items = rows[:limit]
+
+    oldest_id = items[-1].id if items else None
+    return items, {
+        "has_more": has_older,
+        "last_id": oldest_id,
+        "has_newer": has_newer,
+        "older_cursor": encode_cursor(oldest_id) if items and has_older else None,
+        "newer_cursor": encode_cursor(items[0].id) if items and has_newer else None
+    }
@@ -20,4 +20,29 @@ def verify_token(token: str) -> dict:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         return payload
     except JWTError:
-        raise JWTError("Token 无效或已过期")
\ No newline at end of file
+        raise JWTError("Token 无效或已过期")
+
+
+# -------- 断线重连令牌 --------
+def create_resume_token(user_id: int, session_id: str) -> str:
+    """
+    WebSocket 连接成功后下发，断线重连时带上可走优先通道
+    用户 id 放在 uid 而不是 user_id 中，不能当作登录 token 使用
+    """
+    expire = datetime.utcnow() + timedelta(seconds=settings.WS_RESUME_TOKEN_TTL)
+    to_encode = {"typ": "resume", "uid": user_id, "sid": session_id, "exp": expire}
+    return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+
+def verify_resume_token(token: str) -> dict | None:
+    """
+    成功返回 {"user_id": ..., "session_id": ...}
+    无效或过期返回 None（重连令牌只影响排队优先级，不需要报错）
+    """
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("typ") != "resume":
+        return None
+    return {"user_id": payload.get("uid"), "session_id": payload.get("sid")}
@@ -0,0 +1,264 @@
+# 历史数据回填：应用启动时由 init() 自动执行（upgrade），也可手动全部重跑：python -m app.db.backfill
+"""历史数据回填
+
+- messages.conversation_key: 补列和 (conversation_key, id) 索引（create_all 不会给已有的表加列、加索引），
+  再按 id 区间分批 UPDATE 还没有会话键的行
+- group_messages: 补 (group_id, id) 索引（群聊天记录分页）
+- group_members.last_read_message_id: 补列，并按原来全局的 is_read 标记初始化各成员的已读游标
+  （群里最后一条已读消息），之后群已读状态按成员记录
+- group_members.joined_message_id: 补列（群消息已读人数只统计消息发出时已在群里的成员），已有成员为 0
+- conversations（私聊会话表）: 按会话所属用户的 id 分批执行 INSERT ... SELECT
+
+每批一个事务，避免长时间锁住 messages 表。都可以重复执行：会话键只补空值，
+已存在的会话行按消息表重新计算（以较新的最近消息为准）。
+
+启动时 init() 调用 upgrade()，不阻塞启动，多个 worker 同时启动也只有一个在做：
+    - 补列：新代码的查询依赖这些列，在开始处理请求前同步执行（不指定位置，MySQL 8 可以 INSTANT 加列）；
+      持有 MySQL 命名锁 chat_schema_upgrade，其他 worker 等它完成后检查到列已存在直接跳过
+    - 补索引、回填数据：在后台线程里执行，持有命名锁 chat_backfill，抢不到锁说明其他 worker 正在做；
+      这次新加了已读游标列 / 新建了 conversations 表的 worker 会等锁，保证初始化不会被跳过
+回填完成前，老会话的聊天记录和联系人列表可能不完整。数据量大时建议发版前先手动执行本模块
+（python -m app.db.backfill，同步执行全部步骤），启动时就只剩检查。
+"""
+from sqlalchemy import select, update, func, literal, union_all, case, inspect, text, and_
+from sqlalchemy.dialects.mysql import insert
+from app.db.database import SessionLocal, engine
+from app.db.init_db import init
+from app.models.conversations import Conversation
+from app.models.group_members import GroupMember
+from app.models.group_messages import GroupMessage
+from app.models.messages import Messages
+from app.models.user import User
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 每批处理多少个用户的会话
+BATCH_USERS = 1000
+# 会话键每批更新多少个消息 id
+BATCH_MESSAGES = 10000
+
+
+# 已有的表需要补建的索引: (表, 索引名, 列)
+INDEXES = (
+    ("messages", "ix_messages_conversation_key_id", "conversation_key, id"),
+    ("group_messages", "ix_group_messages_group_id_id", "group_id, id"),
+)
+
+
+# MySQL 命名锁（GET_LOCK）：补列 / 后台回填
+SCHEMA_LOCK = "chat_schema_upgrade"
+BACKFILL_LOCK = "chat_backfill"
+# 等待其他 worker 补列的最长时间（秒）
+SCHEMA_LOCK_TIMEOUT = 60
+
+
+def ensure_columns() -> set[str]:
+    """给已有的表补上新增的列，返回这次新加的列（"表.列"）"""
+    inspector = inspect(engine)
+    columns = {c["name"] for c in inspector.get_columns("messages")}
+    member_columns = {c["name"] for c in inspector.get_columns("group_members")}
+    added = set()
+    with engine.begin() as conn:
+        if "conversation_key" not in columns:
+            conn.execute(text("ALTER TABLE messages ADD COLUMN conversation_key BIGINT NULL"))
+            added.add("messages.conversation_key")
+            logger.info("messages 表已添加 conversation_key 列")
+        if "last_read_message_id" not in member_columns:
+            conn.execute(text("ALTER TABLE group_members ADD COLUMN last_read_message_id INT NOT NULL DEFAULT 0"))
+            added.add("group_members.last_read_message_id")
+            logger.info("group_members 表已添加 last_read_message_id 列")
+        if "joined_message_id" not in member_columns:
+            # 已有成员记为 0：历史消息都计入已读人数的统计范围
+            conn.execute(text("ALTER TABLE group_members ADD COLUMN joined_message_id INT NOT NULL DEFAULT 0"))
+            added.add("group_members.joined_message_id")
+            logger.info("group_members 表已添加 joined_message_id 列")
+    return added
+
+
+def ensure_indexes():
+    """给已有的表补上新增的索引（InnoDB 在线建索引，不阻塞读写）"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, name, cols in INDEXES:
+            if name not in {i["name"] for i in inspector.get_indexes(table)}:
+                conn.execute(text(f"CREATE INDEX {name} ON {table} ({cols})"))
+                logger.info(f"{table} 表已添加 ({cols}) 索引")
+
+
+def run_backfills(added: set[str] = frozenset(), new_tables: set[str] = frozenset()):
+    """补索引，并回填新代码依赖的数据：会话键有空值时回填；已读游标列是这次新加的才初始化；
+    conversations 表是这次新建的才回填"""
+    ensure_indexes()
+    with engine.connect() as conn:
+        # 索引建好后走 (conversation_key, id) 索引，已回填完时很快
+        missing_key = conn.scalar(select(Messages.id).where(Messages.conversation_key.is_(None)).limit(1))
+    if missing_key is not None:
+        backfill_conversation_key()
+    if "group_members.last_read_message_id" in added:
+        backfill_group_read_cursors()
+    if "conversations" in new_tables:
+        backfill_conversations()
+
+
+def _backfill_in_background(added: set[str], new_tables: set[str]):
+    must_run = "group_members.last_read_message_id" in added or "conversations" in new_tables
+    with engine.connect() as lock_conn:
+        # 有必须由本 worker 完成的初始化时等锁，否则其他 worker 在做就直接跳过
+        if lock_conn.scalar(text("SELECT GET_LOCK(:name, :timeout)"),
+                            {"name": BACKFILL_LOCK, "timeout": -1 if must_run else 0}) != 1:
+            logger.info("其他 worker 正在回填，跳过")
+            return
+        try:
+            run_backfills(added, new_tables)
+        except Exception as e:
+            logger.error(f"后台回填失败（可手动执行 python -m app.db.backfill）: {e}")
+        finally:
+            lock_conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": BACKFILL_LOCK})
+
+
+def upgrade(new_tables: set[str] = frozenset(), backfill: bool = True):
+    """启动时执行：同步补列，再在后台线程补索引、回填数据（new_tables: 这次 create_all 新建的表）"""
+    with engine.connect() as lock_conn:
+        lock_conn.scalar(text("SELECT GET_LOCK(:name, :timeout)"),
+                         {"name": SCHEMA_LOCK, "timeout": SCHEMA_LOCK_TIMEOUT})
+        try:
+            added = ensure_columns()
+        finally:
+            lock_conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": SCHEMA_LOCK})
+    if not backfill:
+        return
+    threading.Thread(
+        target=_backfill_in_background, args=(added, set(new_tables)), name="backfill", daemon=True
+    ).start()
+
+
+def backfill_conversation_key() -> int:
+    """按 id 区间分批补齐会话键，返回更新的行数"""
+    db = SessionLocal()
+    try:
+        max_id = db.scalar(select(func.max(Messages.id))) or 0
+        key = (
+            func.least(Messages.sender_id, Messages.receiver_id) * 4294967296
+            + func.greatest(Messages.sender_id, Messages.receiver_id)
+        )
+        updated = 0
+        for low in range(0, max_id + 1, BATCH_MESSAGES):
+            result = db.execute(
+                update(Messages)
+                .where(
+                    Messages.id >= low,
+                    Messages.id < low + BATCH_MESSAGES,
+                    Messages.conversation_key.is_(None)
+                )
+                .values(conversation_key=key)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            updated += result.rowcount
+        logger.info(f"会话键回填: 共更新 {updated} 条消息")
+        return updated
+    finally:
+        db.close()
+
+
+def backfill_group_read_cursors() -> int:
+    """按成员 id 区间分批初始化还没有已读游标的成员，返回更新的行数"""
+    db = SessionLocal()
+    try:
+        max_id = db.scalar(select(func.max(GroupMember.id))) or 0
+        last_read = (
+            select(func.coalesce(func.max(GroupMessage.id), 0))
+            .where(GroupMessage.group_id == GroupMember.group_id, GroupMessage.is_read == True)
+            .scalar_subquery()
+        )
+        updated = 0
+        for low in range(0, max_id + 1, BATCH_MESSAGES):
+            result = db.execute(
+                update(GroupMember)
+                .where(
+                    GroupMember.id >= low,
+                    GroupMember.id < low + BATCH_MESSAGES,
+                    GroupMember.last_read_message_id == 0
+                )
+                .values(last_read_message_id=last_read)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            updated += result.rowcount
+        logger.info(f"群已读游标回填: 共更新 {updated} 个成员")
+        return updated
+    finally:
+        db.close()
+
+
+def _conversation_rows(low: int, high: int):
+    """owner_id 在 [low, high) 内的会话：发出的消息和收到的消息各算一边"""
+    sent = select(
+        Messages.sender_id.label("owner_id"),
+        Messages.receiver_id.label("peer_id"),
+        Messages.id.label("message_id"),
+        Messages.created_at.label("created_at"),
+        literal(0).label("unread")
+    ).where(Messages.sender_id >= low, Messages.sender_id < high)
+    received = select(
+        Messages.receiver_id,
+        Messages.sender_id,
+        Messages.id,
+        Messages.created_at,
+        # 已撤回的消息不计入未读（与撤回时扣减未读数一致）
+        case((and_(Messages.is_read == False, Messages.msg_type != 4), 1), else_=0)
+    ).where(Messages.receiver_id >= low, Messages.receiver_id < high)
+    both = union_all(sent, received).subquery()
+    return select(
+        both.c.owner_id,
+        both.c.peer_id,
+        func.max(both.c.message_id),
+        func.max(both.c.created_at),
+        func.sum(both.c.unread)
+    ).group_by(both.c.owner_id, both.c.peer_id)
+
+
+def backfill_conversations() -> int:
+    """回填全部会话，返回处理的批数"""
+    db = SessionLocal()
+    try:
+        max_user_id = db.scalar(select(func.max(User.id))) or 0
+        batches = 0
+        for low in range(0, max_user_id + 1, BATCH_USERS):
+            stmt = insert(Conversation).from_select(
+                ["owner_id", "peer_id", "last_message_id", "last_message_at", "unread_count"],
+                _conversation_rows(low, low + BATCH_USERS)
+            )
+            db.execute(stmt.on_duplicate_key_update(
+                last_message_id=func.greatest(
+                    func.coalesce(Conversation.last_message_id, 0), stmt.inserted.last_message_id
+                ),
+                last_message_at=func.greatest(
+                    func.coalesce(Conversation.last_message_at, stmt.inserted.last_message_at),
+                    stmt.inserted.last_message_at
+                ),
+                unread_count=stmt.inserted.unread_count
+            ))
+            db.commit()
+            batches += 1
+            logger.info(f"会话回填: 用户 {low} ~ {low + BATCH_USERS - 1} 完成")
+        return batches
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    init(backfill=False)   # 建表、补列
+    with engine.connect() as lock_conn:
+        # 等正在运行的 worker 完成后台回填，期间它们不会再启动新的回填
+        lock_conn.scalar(text("SELECT GET_LOCK(:name, -1)"), {"name": BACKFILL_LOCK})
+        try:
+            ensure_indexes()
+            print(f"✅ 会话键回填完成，共 {backfill_conversation_key()} 条消息")
+            print(f"✅ 会话回填完成，共 {backfill_conversations()} 批")
+            print(f"✅ 群已读游标回填完成，共 {backfill_group_read_cursors()} 个成员")
+        finally:
+            lock_conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": BACKFILL_LOCK})
@@ -1,7 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import QueuePool
+import asyncio
 
 from app.core.config import settings
 
@@ -32,4 +35,18 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# 数据库线程池：async 代码（WebSocket、async 接口）里的同步查询放到这里执行，避免阻塞事件循环
+# 线程数有上限，数据库变慢时请求在这里排队，而不是占满事件循环或无限创建线程
+db_executor = ThreadPoolExecutor(max_workers=settings.DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run_db(func, *args, **kwargs):
+    """在数据库线程池中执行同步函数并等待结果
+
+    同一个 Session 不能被并发使用，调用方需保证对同一个 db 的 run_db 依次 await
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(func, *args, **kwargs))
\ No newline at end of file
@@ -1,23 +1,29 @@
 # 把模型先引进来，Base 才知道要建哪些表
 from app.db.database import Base, engine
-from app.models import user, contact, messages, groups, group_members, group_messages
+from app.models import user, contact, messages, groups, group_members, group_messages, conversations
+from sqlalchemy import inspect
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
-def init():
+def init(backfill: bool = True):
     """
     初始化数据库表
     使用重试机制处理并发DDL冲突
+    已有的表由 backfill.upgrade 补列（新代码依赖这些列，在处理请求前完成），
+    补索引和回填数据在后台线程中进行（backfill=False 时不启动，由调用方自己执行）
     """
     max_retries = 5
     retry_delay = 2  # 秒
     
     for attempt in range(max_retries):
         try:
-            # 如果表已存在则跳过；有新字段会自动加
+            # 如果表已存在则跳过；create_all 不会给已有的表加列，由 upgrade 补齐
+            existing = set(inspect(engine).get_table_names())
             Base.metadata.create_all(bind=engine, checkfirst=True)
+            from app.db.backfill import upgrade
+            upgrade(new_tables=set(Base.metadata.tables) - existing, backfill=backfill)
             logger.info("✅ 数据库表已创建/更新完成")
             print("✅ 数据库表已创建/更新完成")
             return
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, UniqueConstraint, Index
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class Conversation(Base):
+    """私聊会话（每个用户对每个聊天对象一行），由发消息 / 标记已读 / 撤回在同一事务中维护"""
+    __tablename__ = "conversations"
+    __table_args__ = (
+        UniqueConstraint("owner_id", "peer_id", name="uq_conversations_owner_peer"),
+        # 联系人列表按最近消息时间排序
+        Index("ix_conversations_owner_last_at", "owner_id", "last_message_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+
+    # 会话所属用户 & 聊天对象
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    peer_id  = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+
+    # 最近一条消息（双方任一方发出）
+    last_message_id = Column(Integer, nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+
+    # 对方发来的未读消息数
+    unread_count = Column(Integer, default=0, nullable=False)
+
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
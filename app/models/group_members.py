@@ -14,4 +14,8 @@ class GroupMember(Base):
     #角色
     role = Column(Integer, nullable=False, default=3) #1-群主 2-管理员 3-普通成员
     #加入时间
-    joined_at = Column(DateTime, nullable=False)
\ No newline at end of file
+    joined_at = Column(DateTime, nullable=False)
+    #已读到的最大群消息ID（之后的他人消息为未读）
+    last_read_message_id = Column(Integer, nullable=False, default=0, server_default="0")
+    #入群时群里最新的消息ID（不大于它的消息发出时还不在群里，不计入已读人数）
+    joined_message_id = Column(Integer, nullable=False, default=0, server_default="0")
\ No newline at end of file
@@ -1,9 +1,13 @@
-from sqlalchemy import Column, Integer, String, Text, SmallInteger, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, SmallInteger, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.sql import func
 from app.db.database import Base
 
 class GroupMessage(Base):
     __tablename__ = "group_messages"
+    __table_args__ = (
+        # 群聊天记录按群 + id 做一次范围扫描
+        Index("ix_group_messages_group_id_id", "group_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
 
@@ -17,7 +21,7 @@ class GroupMessage(Base):
     # 消息类型：1-文本 2-图片 3-文件 4-撤回 ...
     msg_type = Column(SmallInteger, default=1, nullable=False)
 
-    # 已读标记
+    # 已读标记（已废弃：群内已读状态按成员记录在 GroupMember.last_read_message_id）
     is_read = Column(Boolean, default=False, nullable=False)
 
     # 创建 & 更新（撤回/编辑时更新）
@@ -1,10 +1,20 @@
-from sqlalchemy import Column, Integer, String, Text, SmallInteger, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, SmallInteger, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db.database import Base
 
+def conversation_key(user_a: int, user_b: int) -> int:
+    """两人私聊的会话键：较小的用户 id 在高 32 位，较大的在低 32 位，与方向无关"""
+    low, high = sorted((user_a, user_b))
+    return (low << 32) | high
+
+
 class Messages(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # 聊天记录按会话键 + id 做一次范围扫描
+        Index("ix_messages_conversation_key_id", "conversation_key", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
 
@@ -12,6 +22,9 @@ class Messages(Base):
     sender_id   = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     receiver_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
 
+    # 会话键 conversation_key(sender_id, receiver_id)，历史数据由 app/db/backfill.py 回填
+    conversation_key = Column(BigInteger, nullable=True)
+
     # 消息内容
     content = Column(Text, nullable=False)
 
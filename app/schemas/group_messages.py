@@ -35,8 +35,19 @@ class GroupMessageResponse(BaseModel):
         from_attributes = True
 
 
+# 群消息已读情况（由成员已读游标推算）
+class GroupMessageReadBy(BaseModel):
+    message_id: int
+    read_count: int  # 已读人数（不含发送者）
+    member_count: int  # 消息发出时已在群里的其他成员数
+    user_ids: List[int] | None = None  # 已读成员，with_users=true 时返回
+
+
 # 群消息分页
 class GroupMessagePage(BaseModel):
     items: List[GroupMessageResponse]
-    has_more: bool
+    has_more: bool  # 是否还有更早的消息
     last_id: int | None
+    has_newer: bool = False  # 是否还有更新的消息
+    older_cursor: str | None = None  # 传给 before 取更早的一页
+    newer_cursor: str | None = None  # 传给 after 取更新的一页
@@ -34,5 +34,8 @@ class UploadResponse(BaseModel):
 
 class Messagepage (BaseModel):
     items : List[MessageResponse]
-    has_more: bool
-    last_id : int |None
\ No newline at end of file
+    has_more: bool  # 是否还有更早的消息
+    last_id : int |None
+    has_newer: bool = False  # 是否还有更新的消息
+    older_cursor: str | None = None  # 传给 before 取更早的一页
+    newer_cursor: str | None = None  # 传给 after 取更新的一页
\ No newline at end of file
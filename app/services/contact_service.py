@@ -1,15 +1,63 @@
 # services/contact_service.py
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import select, delete, desc, func, and_
+from sqlalchemy import select, delete, and_
 from app.models.contact import Contact
 from app.models.user import User
 from app.models.messages import Messages
+from app.models.conversations import Conversation
 from app.schemas.contact import ContactResponse
 from datetime import datetime, timezone
 from app.core.server_config import get_server_url
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.db.database import run_db
+from app.websocket.manager import manager
+from app.services.presence_store import presence_store
 
 from fastapi import HTTPException, status
 
+# 联系人邻接缓存: {user_id: frozenset(contact_user_id)}
+_contact_cache = LRUCache(settings.CONTACT_CACHE_SIZE, ttl=settings.CONTACT_CACHE_TTL)
+
+
+def get_contact_ids(db: Session, user_id: int) -> frozenset[int]:
+    """获取用户所有联系人的 user_id，优先走缓存
+
+    联系人关系是双向插入的，只按 user_id 查即可走索引
+    """
+    contact_ids = _contact_cache.get(user_id)
+    if contact_ids is None:
+        contact_ids = frozenset(db.scalars(
+            select(Contact.contact_user_id).where(Contact.user_id == user_id)
+        ).all())
+        _contact_cache.set(user_id, contact_ids)
+    return contact_ids
+
+
+async def get_contact_ids_async(db: Session, user_id: int) -> frozenset[int]:
+    """get_contact_ids 的 async 版本：命中缓存直接返回，未命中时在数据库线程池中查询"""
+    contact_ids = _contact_cache.get(user_id)
+    if contact_ids is None:
+        contact_ids = await run_db(get_contact_ids, db, user_id)
+    return contact_ids
+
+
+def _update_contact_cache(user_id: int, contact_user_id: int, added: bool):
+    """联系人变动后更新双方的缓存（其他 worker 直接失效）"""
+    for owner, other in ((user_id, contact_user_id), (contact_user_id, user_id)):
+        cached = _contact_cache.get(owner)
+        if cached is not None:
+            _contact_cache.set(owner, cached | {other} if added else cached - {other})
+    manager.publish_event("contacts_invalidate", {"user_ids": [user_id, contact_user_id]})
+
+
+async def _on_contacts_invalidate(source: str, payload: dict, body: bytes | None):
+    for user_id in payload["user_ids"]:
+        _contact_cache.pop(user_id)
+
+manager.bus.subscribe("contacts_invalidate", _on_contacts_invalidate)
+
+
 def _format_time_ago(dt: datetime) -> str:
     """将时间转换为相对时间格式，如 '15 min ago'"""
     # MySQL 存储的是本地时间（东八区），直接用本地时间计算
@@ -42,65 +90,56 @@ def _format_time_ago(dt: datetime) -> str:
 
 def _to_contact_resp(contact: Contact, last_msg: Messages | None = None, unread_cnt: int = 0) -> ContactResponse:
     u = contact.contact_user
+    # 实时状态以内存为准，数据库中的值可能还未回写
+    status, last_seen = presence_store.resolve(u)
     return ContactResponse(
         id=contact.id,
         user_id=contact.contact_user_id,  # 添加真实用户 ID
         name=u.username,
         avatar=f"{get_server_url()}{u.avatar}" if u.avatar else None,
-        status=getattr(u, "status", "offline") or "offline",
+        status=status,
         bio=u.bio,
-        lastSeen=u.last_seen.isoformat() if u.last_seen else None,
+        lastSeen=last_seen.isoformat() if last_seen else None,
         lastMegTime=_format_time_ago(last_msg.created_at) if last_msg else None,
         lastMeg=last_msg.content if last_msg else None,
         count=unread_cnt,
         is_favorite=contact.is_favorite,
     )
 
-def get_contacts(db: Session, user_id: int) -> list[ContactResponse]:
-    # 获取所有联系人（预加载 contact_user）
-    stmt = (
-        select(Contact)
+def _contact_query(user_id: int):
+    """联系人 + 会话 + 最近一条消息，一次联表查询"""
+    return (
+        select(Contact, Conversation.unread_count, Messages)
+        .outerjoin(
+            Conversation,
+            and_(Conversation.owner_id == Contact.user_id, Conversation.peer_id == Contact.contact_user_id)
+        )
+        .outerjoin(Messages, Messages.id == Conversation.last_message_id)
         .where(Contact.user_id == user_id)
         .options(joinedload(Contact.contact_user))
-        .order_by(Contact.is_favorite.desc(), Contact.created_at.desc())
     )
-    contacts = db.scalars(stmt).unique().all()
-    
-    result = []
-    for contact in contacts:
-        contact_user_id = contact.contact_user_id
-        
-        # 获取最新一条消息（对方发给我的）
-        last_msg = db.scalar(
-            select(Messages)
-            .where(
-                Messages.sender_id == contact_user_id,
-                Messages.receiver_id == user_id
-            )
-            .order_by(desc(Messages.created_at))
-            .limit(1)
-        )
-        
-        # 获取未读消息数
-        unread_cnt = db.scalar(
-            select(func.count(Messages.id))
-            .where(
-                Messages.sender_id == contact_user_id,
-                Messages.receiver_id == user_id,
-                Messages.is_read == False
-            )
-        ) or 0
-        
-        result.append(_to_contact_resp(contact, last_msg, unread_cnt))
-    
-    # 按是否特别关心和最新消息时间排序
-    result.sort(key=lambda x: (
-        not x.is_favorite,
-        x.lastMegTime is None,
-        x.lastMegTime or ""
-    ), reverse=False)
-    
-    return result
+
+
+def get_contacts(db: Session, user_id: int) -> list[ContactResponse]:
+    # 特别关心在前，其余按最近消息时间倒序（没有消息的排最后）
+    stmt = _contact_query(user_id).order_by(
+        Contact.is_favorite.desc(),
+        Conversation.last_message_at.is_(None),
+        Conversation.last_message_at.desc(),
+        Contact.created_at.desc()
+    )
+    rows = db.execute(stmt).unique().all()
+    return [_to_contact_resp(contact, last_msg, unread_cnt or 0) for contact, unread_cnt, last_msg in rows]
+
+
+def _get_contact(db: Session, user_id: int, contact_user_id: int) -> ContactResponse:
+    row = db.execute(
+        _contact_query(user_id).where(Contact.contact_user_id == contact_user_id)
+    ).unique().first()
+    if not row:
+        raise HTTPException(status_code=404, detail="联系人不存在")
+    contact, unread_cnt, last_msg = row
+    return _to_contact_resp(contact, last_msg, unread_cnt or 0)
 
 
 def add_contact(db: Session, user_id: int, contact_user_id: int) -> ContactResponse:
@@ -118,6 +157,7 @@ def add_contact(db: Session, user_id: int, contact_user_id: int) -> ContactRespo
     reverse = Contact(user_id=contact_user_id, contact_user_id=user_id)
     db.add_all([forward, reverse])
     db.commit()
+    _update_contact_cache(user_id, contact_user_id, added=True)
     
     # 刷新并加载关联的 contact_user
     db.refresh(forward)
@@ -140,6 +180,7 @@ def remove_contact(db: Session, user_id: int, contact_user_id: int) -> None:
         )
     )
     db.commit()
+    _update_contact_cache(user_id, contact_user_id, added=False)
 
 def toggle_favorite(db: Session, user_id: int, contact_user_id: int) -> ContactResponse:
     """切换特别关心"""
@@ -160,62 +201,8 @@ def toggle_favorite(db: Session, user_id: int, contact_user_id: int) -> ContactR
     contact.is_favorite = not contact.is_favorite
     db.commit()
     
-    # 获取最新消息和未读数
-    last_msg = db.scalar(
-        select(Messages)
-        .where(
-            Messages.sender_id == contact_user_id,
-            Messages.receiver_id == user_id
-        )
-        .order_by(desc(Messages.created_at))
-        .limit(1)
-    )
-    
-    unread_cnt = db.scalar(
-        select(func.count(Messages.id))
-        .where(
-            Messages.sender_id == contact_user_id,
-            Messages.receiver_id == user_id,
-            Messages.is_read == False
-        )
-    ) or 0
-
-    return _to_contact_resp(contact, last_msg, unread_cnt)
+    return _get_contact(db, user_id, contact_user_id)
 
 def get_contact_detail(db: Session, user_id: int, contact_user_id: int) -> ContactResponse:
     """获取指定联系人详情"""
-    # 查询联系人关系并预加载 contact_user
-    stmt = (
-        select(Contact)
-        .where(
-            (Contact.user_id == user_id) & (Contact.contact_user_id == contact_user_id)
-        )
-        .options(joinedload(Contact.contact_user))
-    )
-    contact = db.scalar(stmt)
-
-    if not contact:
-        raise HTTPException(status_code=404, detail="联系人不存在")
-    
-    # 获取最新消息
-    last_msg = db.scalar(
-        select(Messages)
-        .where(
-            Messages.sender_id == contact_user_id,
-            Messages.receiver_id == user_id
-        )
-        .order_by(desc(Messages.created_at))
-        .limit(1)
-    )
-    
-    # 获取未读消息数
-    unread_cnt = db.scalar(
-        select(func.count(Messages.id))
-        .where(
-            Messages.sender_id == contact_user_id,
-            Messages.receiver_id == user_id,
-            Messages.is_read == False
-        )
-    ) or 0
-
-    return _to_contact_resp(contact, last_msg, unread_cnt)
\ No newline at end of file
+    return _get_contact(db, user_id, contact_user_id)
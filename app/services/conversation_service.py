@@ -0,0 +1,74 @@
+# services/conversation_service.py
+"""私聊会话表的维护
+
+conversations 为每个用户对每个聊天对象保存一行：最近一条消息和未读数。
+联系人列表一次联表查询即可拿到最近消息和未读数，不必对每个联系人各查一次。
+
+这里的函数只执行语句、不提交，由调用方（发消息 / 标记已读 / 撤回）在同一事务中提交。
+写入使用 MySQL 的 INSERT ... ON DUPLICATE KEY UPDATE，历史数据用 app/db/backfill.py 回填。
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import select, update, func
+from sqlalchemy.dialects.mysql import insert
+from app.models.conversations import Conversation
+
+
+def record_message(db: Session, sender_id: int, receiver_id: int, message_id: int) -> None:
+    """新消息：更新双方会话的最近消息，接收方未读数加一"""
+    rows = [
+        {"owner_id": sender_id, "peer_id": receiver_id, "last_message_id": message_id,
+         "last_message_at": func.now(), "unread_count": 0},
+        {"owner_id": receiver_id, "peer_id": sender_id, "last_message_id": message_id,
+         "last_message_at": func.now(), "unread_count": 1},
+    ]
+    # 双方同时发消息时，两个事务要按相同顺序加锁，否则 InnoDB 会判定死锁
+    rows.sort(key=lambda row: (row["owner_id"], row["peer_id"]))
+    stmt = insert(Conversation).values(rows)
+    # 并发写入时提交顺序可能与 id 顺序不一致，取较大值避免最近消息倒退
+    db.execute(stmt.on_duplicate_key_update(
+        last_message_id=func.greatest(func.coalesce(Conversation.last_message_id, 0), stmt.inserted.last_message_id),
+        last_message_at=func.greatest(
+            func.coalesce(Conversation.last_message_at, stmt.inserted.last_message_at),
+            stmt.inserted.last_message_at
+        ),
+        unread_count=Conversation.unread_count + stmt.inserted.unread_count
+    ))
+
+
+def clear_unread(db: Session, owner_id: int, peer_id: int) -> None:
+    """与某人的消息全部已读"""
+    db.execute(
+        update(Conversation)
+        .where(Conversation.owner_id == owner_id, Conversation.peer_id == peer_id, Conversation.unread_count != 0)
+        .values(unread_count=0)
+    )
+
+
+def decrement_unread(db: Session, owner_id: int, peer_id: int, count: int = 1) -> None:
+    """未读消息被撤回"""
+    db.execute(
+        update(Conversation)
+        .where(Conversation.owner_id == owner_id, Conversation.peer_id == peer_id)
+        .values(unread_count=func.greatest(Conversation.unread_count - count, 0))
+    )
+
+
+def get_unread_count(db: Session, owner_id: int, peer_id: int) -> int:
+    return db.scalar(
+        select(Conversation.unread_count)
+        .where(Conversation.owner_id == owner_id, Conversation.peer_id == peer_id)
+    ) or 0
+
+
+def get_total_unread_count(db: Session, owner_id: int) -> int:
+    return db.scalar(
+        select(func.sum(Conversation.unread_count)).where(Conversation.owner_id == owner_id)
+    ) or 0
+
+
+def get_unread_counts_by_peer(db: Session, owner_id: int) -> dict[int, int]:
+    rows = db.execute(
+        select(Conversation.peer_id, Conversation.unread_count)
+        .where(Conversation.owner_id == owner_id, Conversation.unread_count > 0)
+    ).all()
+    return {peer_id: count for peer_id, count in rows}
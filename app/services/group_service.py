@@ -1,7 +1,9 @@
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import select, desc, func, and_, or_
+from sqlalchemy import select, update, delete, desc, func, and_, or_
 from typing import Optional
 from datetime import datetime
+from bisect import bisect_left
+import threading
 from fastapi import HTTPException
 from app.models.groups import Group
 from app.models.group_members import GroupMember
@@ -9,8 +11,60 @@ from app.models.group_messages import GroupMessage
 from app.models.user import User
 from app.schemas.groups import GroupCreate, GroupUpdate, GroupResponse
 from app.schemas.group_members import GroupMemberAdd, GroupMemberRoleUpdate, GroupMemberResponse
-from app.schemas.group_messages import GroupMessageCreate, GroupMessageResponse, GroupMessagePage
+from app.schemas.group_messages import GroupMessageCreate, GroupMessageResponse, GroupMessagePage, GroupMessageReadBy
 from app.websocket.manager import manager
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.db.database import run_db
+from app.core.pagination import paginate
+
+
+# ==================== 群成员缓存 ====================
+
+# 群成员及角色缓存: {group_id: {user_id: role}}
+_member_cache = LRUCache(settings.GROUP_MEMBER_CACHE_SIZE, ttl=settings.GROUP_MEMBER_CACHE_TTL)
+# 每个群的失效代数: {group_id: 失效次数}。查库期间群成员发生变动（代数变化）时不回填缓存，
+# 避免把变动前查到的成员列表写回去
+_member_generation: dict[int, int] = {}
+_member_lock = threading.Lock()
+
+
+def get_member_roles(db: Session, group_id: int) -> dict[int, int]:
+    """获取群内所有成员的角色 {user_id: role}，优先走缓存（返回值只读）"""
+    roles = _member_cache.get(group_id)
+    if roles is None:
+        generation = _member_generation.get(group_id, 0)
+        rows = db.execute(
+            select(GroupMember.user_id, GroupMember.role).where(GroupMember.group_id == group_id)
+        ).all()
+        roles = {user_id: role for user_id, role in rows}
+        with _member_lock:
+            if _member_generation.get(group_id, 0) == generation:
+                _member_cache.set(group_id, roles)
+    return roles
+
+
+def get_member_role(db: Session, group_id: int, user_id: int) -> int | None:
+    """获取用户在群内的角色，不是群成员返回 None"""
+    return get_member_roles(db, group_id).get(user_id)
+
+
+def _drop_group_members(group_id: int):
+    with _member_lock:
+        _member_generation[group_id] = _member_generation.get(group_id, 0) + 1
+        _member_cache.pop(group_id)
+
+
+def invalidate_group_members(group_id: int):
+    """群成员变动后失效缓存（同时通知其他 worker）"""
+    _drop_group_members(group_id)
+    manager.publish_event("group_members_invalidate", {"group_id": group_id})
+
+
+async def _on_group_members_invalidate(source: str, payload: dict, body: bytes | None):
+    _drop_group_members(payload["group_id"])
+
+manager.bus.subscribe("group_members_invalidate", _on_group_members_invalidate)
 
 
 # ==================== 群组管理 ====================
@@ -36,6 +90,7 @@ def create_group(db: Session, group_data: GroupCreate, owner_id: int) -> Group:
     db.add(owner_member)
     db.commit()
     db.refresh(new_group)
+    invalidate_group_members(new_group.id)
     return new_group
 
 
@@ -69,13 +124,7 @@ def search_user_groups(db: Session, user_id: int, keyword: str) -> list[GroupRes
 def get_group_detail(db: Session, group_id: int, user_id: int) -> GroupResponse:
     """获取群组详情（需要是群成员）"""
     # 检查是否是群成员
-    member = db.scalar(
-        select(GroupMember).where(
-            GroupMember.group_id == group_id,
-            GroupMember.user_id == user_id
-        )
-    )
-    if not member:
+    if get_member_role(db, group_id, user_id) is None:
         raise HTTPException(403, "您不是该群成员")
     
     group = db.get(Group, group_id)
@@ -92,13 +141,7 @@ def update_group(db: Session, group_id: int, user_id: int, update_data: GroupUpd
         raise HTTPException(404, "群组不存在")
     
     # 检查权限
-    member = db.scalar(
-        select(GroupMember).where(
-            GroupMember.group_id == group_id,
-            GroupMember.user_id == user_id
-        )
-    )
-    if not member or member.role not in [1, 2]:  # 1-群主 2-管理员
+    if get_member_role(db, group_id, user_id) not in [1, 2]:  # 1-群主 2-管理员
         raise HTTPException(403, "无权限修改群组信息")
     
     # 更新字段
@@ -126,6 +169,7 @@ def delete_group(db: Session, group_id: int, user_id: int) -> None:
     # 删除群成员和消息（如果设置了级联删除会自动处理）
     db.delete(group)
     db.commit()
+    invalidate_group_members(group_id)
 
 
 # ==================== 群成员管理 ====================
@@ -133,13 +177,7 @@ def delete_group(db: Session, group_id: int, user_id: int) -> None:
 def get_group_members(db: Session, group_id: int, user_id: int) -> list[dict]:
     """获取群成员列表（需要是群成员）"""
     # 检查是否是群成员
-    member = db.scalar(
-        select(GroupMember).where(
-            GroupMember.group_id == group_id,
-            GroupMember.user_id == user_id
-        )
-    )
-    if not member:
+    if get_member_role(db, group_id, user_id) is None:
         raise HTTPException(403, "您不是该群成员")
     
     # 获取所有成员及用户信息
@@ -165,39 +203,30 @@ def get_group_members(db: Session, group_id: int, user_id: int) -> list[dict]:
     return members
 
 
-async def add_group_member(db: Session, group_id: int, operator_id: int, target_user_id: int) -> GroupMemberResponse:
-    """添加群成员（群主和管理员可操作）"""
+def _insert_group_member(db: Session, group_id: int, operator_id: int, target_user_id: int) -> tuple[Group, GroupMember]:
     # 检查群是否存在
     group = db.get(Group, group_id)
     if not group:
         raise HTTPException(404, "群组不存在")
     
     # 检查操作者权限
-    operator = db.scalar(
-        select(GroupMember).where(
-            GroupMember.group_id == group_id,
-            GroupMember.user_id == operator_id
-        )
-    )
-    if not operator or operator.role not in [1, 2]:
+    roles = get_member_roles(db, group_id)
+    if roles.get(operator_id) not in [1, 2]:
         raise HTTPException(403, "无权限添加成员")
     
     # 检查目标用户是否已在群中
-    existing = db.scalar(
-        select(GroupMember).where(
-            GroupMember.group_id == group_id,
-            GroupMember.user_id == target_user_id
-        )
-    )
-    if existing:
+    if target_user_id in roles:
         raise HTTPException(400, "用户已在群中")
     
-    # 添加成员
+    # 添加成员（入群前的消息不算未读，也不计入已读人数）
+    latest_id = _latest_group_message_id(db, group_id)
     new_member = GroupMember(
         group_id=group_id,
         user_id=target_user_id,
         role=3,  # 3-普通成员
-        joined_at=datetime.now()
+        joined_at=datetime.now(),
+        last_read_message_id=latest_id,
+        joined_message_id=latest_id
     )
     db.add(new_member)
     
@@ -206,6 +235,14 @@ async def add_group_member(db: Session, group_id: int, operator_id: int, target_
     
     db.commit()
     db.refresh(new_member)
+    return group, new_member
+
+
+async def add_group_member(db: Session, group_id: int, operator_id: int, target_user_id: int) -> GroupMemberResponse:
+    """添加群成员（群主和管理员可操作）"""
+    # 校验和写库在数据库线程池中执行，不阻塞事件循环
+    group, new_member = await run_db(_insert_group_member, db, group_id, operator_id, target_user_id)
+    invalidate_group_members(group_id)
     
     # 发送 WebSocket 通知给被添加的用户
     if manager.is_online(target_user_id):
@@ -226,32 +263,23 @@ async def add_group_member(db: Session, group_id: int, operator_id: int, target_
 
 def remove_group_member(db: Session, group_id: int, operator_id: int, target_user_id: int) -> None:
     """移除群成员（群主和管理员可操作，或自己退群）"""
+    roles = get_member_roles(db, group_id)
+    
     # 检查操作者权限
-    operator = db.scalar(
-        select(GroupMember).where(
-            GroupMember.group_id == group_id,
-            GroupMember.user_id == operator_id
-        )
-    )
-    if not operator:
+    operator_role = roles.get(operator_id)
+    if operator_role is None:
         raise HTTPException(403, "您不是该群成员")
     
     # 检查目标成员
-    target = db.scalar(
-        select(GroupMember).where(
-            GroupMember.group_id == group_id,
-            GroupMember.user_id == target_user_id
-        )
-    )
-    if not target:
+    if target_user_id not in roles:
         raise HTTPException(404, "目标用户不在群中")
     
     # 权限检查：自己退群 或 管理员/群主踢人
     if operator_id == target_user_id:
         # 自己退群
-        if operator.role == 1:
+        if operator_role == 1:
             raise HTTPException(400, "群主不能退群，请先转让群主或解散群组")
-    elif operator.role not in [1, 2]:
+    elif operator_role not in [1, 2]:
         raise HTTPException(403, "无权限移除成员")
     
     # 获取群组并更新人数 -1
@@ -259,20 +287,20 @@ def remove_group_member(db: Session, group_id: int, operator_id: int, target_use
     if group:
         group.member_count = max(0, group.member_count - 1)
     
-    db.delete(target)
+    db.execute(
+        delete(GroupMember).where(
+            GroupMember.group_id == group_id,
+            GroupMember.user_id == target_user_id
+        )
+    )
     db.commit()
+    invalidate_group_members(group_id)
 
 
 def update_member_role(db: Session, group_id: int, operator_id: int, target_user_id: int, new_role: int) -> GroupMemberResponse:
     """更新群成员角色（仅群主可操作）"""
     # 检查操作者是否是群主
-    operator = db.scalar(
-        select(GroupMember).where(
-            GroupMember.group_id == group_id,
-            GroupMember.user_id == operator_id
-        )
-    )
-    if not operator or operator.role != 1:
+    if get_member_role(db, group_id, operator_id) != 1:
         raise HTTPException(403, "只有群主可以修改成员角色")
     
     # 检查目标成员
@@ -291,22 +319,17 @@ def update_member_role(db: Session, group_id: int, operator_id: int, target_user
     target.role = new_role
     db.commit()
     db.refresh(target)
+    invalidate_group_members(group_id)
     
     return GroupMemberResponse.model_validate(target)
 
 
 # ==================== 群消息管理 ====================
 
-async def send_group_message(db: Session, sender_id: int, message_data: GroupMessageCreate) -> GroupMessage:
-    """发送群消息"""
+def _save_group_message(db: Session, sender_id: int, message_data: GroupMessageCreate) -> tuple[GroupMessage, dict[int, int]]:
     # 检查是否是群成员
-    member = db.scalar(
-        select(GroupMember).where(
-            GroupMember.group_id == message_data.group_id,
-            GroupMember.user_id == sender_id
-        )
-    )
-    if not member:
+    roles = get_member_roles(db, message_data.group_id)
+    if sender_id not in roles:
         raise HTTPException(403, "您不是该群成员")
     
     # 创建消息
@@ -320,24 +343,25 @@ async def send_group_message(db: Session, sender_id: int, message_data: GroupMes
     db.add(new_message)
     db.commit()
     db.refresh(new_message)
+    return new_message, roles
+
+
+async def send_group_message(db: Session, sender_id: int, message_data: GroupMessageCreate) -> GroupMessage:
+    """发送群消息"""
+    # 校验和写库在数据库线程池中执行，不阻塞事件循环
+    new_message, roles = await run_db(_save_group_message, db, sender_id, message_data)
     
     # 推送消息给群内所有在线成员（除了发送者）
-    stmt = select(GroupMember.user_id).where(
-        GroupMember.group_id == message_data.group_id,
-        GroupMember.user_id != sender_id
-    )
-    member_ids = db.scalars(stmt).all()
+    member_ids = [uid for uid in roles if uid != sender_id]
     
     message_response = GroupMessageResponse.model_validate(new_message)
-    for member_id in member_ids:
-        if manager.is_online(member_id):
-            await manager.send_personal_message(
-                member_id,
-                {
-                    "type": "new_group_message",
-                    "data": message_response.model_dump(mode='json')
-                }
-            )
+    await manager.fanout(
+        member_ids,
+        {
+            "type": "new_group_message",
+            "data": message_response.model_dump(mode='json')
+        }
+    )
     
     return new_message
 
@@ -347,82 +371,166 @@ def get_group_messages(
     group_id: int,
     user_id: int,
     last_id: Optional[int] = None,
-    limit: int = 99
+    limit: int = 99,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    around: Optional[int] = None
 ) -> GroupMessagePage:
-    """获取群聊天记录（分页）"""
+    """获取群聊天记录（keyset 分页，见 core/pagination.py）"""
     # 1. 验成员
-    member = db.scalar(
-        select(GroupMember).where(
-            GroupMember.group_id == group_id,
-            GroupMember.user_id == user_id
-        )
-    )
-    if not member:
+    if get_member_role(db, group_id, user_id) is None:
         raise HTTPException(403, "您不是该群成员")
 
     # 2. 查消息
     query = db.query(GroupMessage).filter(GroupMessage.group_id == group_id)
-    if last_id:
-        query = query.filter(GroupMessage.id < last_id)
-
-    msgs = query.order_by(desc(GroupMessage.created_at)).limit(limit + 1).all()
+    msgs, page = paginate(
+        query, GroupMessage.id, limit, before=before, after=after, around=around, last_id=last_id
+    )
 
     # 3. 组装分页
-    has_more = len(msgs) > limit
-    if has_more:
-        msgs = msgs[:limit]
-
-    last_message_id = msgs[-1].id if msgs else None
-
     return GroupMessagePage(
         items=[GroupMessageResponse.model_validate(m) for m in msgs],
-        has_more=has_more,
-        last_id=last_message_id
+        **page
     )
 
 
-def get_group_unread_count(db: Session, group_id: int, user_id: int) -> int:
-    """获取群未读消息数"""
-    # 检查是否是群成员
-    member = db.scalar(
-        select(GroupMember).where(
-            GroupMember.group_id == group_id,
-            GroupMember.user_id == user_id
-        )
+def _latest_group_message_id(db: Session, group_id: int) -> int:
+    """群内最新一条消息的 id（走 (group_id, id) 索引）"""
+    return db.scalar(select(func.max(GroupMessage.id)).where(GroupMessage.group_id == group_id)) or 0
+
+
+def _count_unread(db: Session, group_id: int, user_id: int, after_id: int, up_to: int | None = None) -> int:
+    """统计 after_id 之后他人发送的消息数，最多数到 GROUP_UNREAD_MAX 条"""
+    query = select(GroupMessage.id).where(
+        GroupMessage.group_id == group_id,
+        GroupMessage.id > after_id,
+        GroupMessage.sender_id != user_id
+    )
+    if up_to is not None:
+        query = query.where(GroupMessage.id <= up_to)
+    bounded = query.limit(settings.GROUP_UNREAD_MAX).subquery()
+    return db.scalar(select(func.count()).select_from(bounded)) or 0
+
+
+def _get_read_cursor(db: Session, group_id: int, user_id: int) -> int | None:
+    """成员已读到的消息 id，不是群成员返回 None"""
+    return db.scalar(
+        select(GroupMember.last_read_message_id)
+        .where(GroupMember.group_id == group_id, GroupMember.user_id == user_id)
     )
-    if not member:
+
+
+def get_group_unread_count(db: Session, group_id: int, user_id: int) -> int:
+    """获取群未读消息数（已读游标之后他人发送的消息，最多 GROUP_UNREAD_MAX 条）"""
+    cursor = _get_read_cursor(db, group_id, user_id)
+    if cursor is None:
         return 0
+    return _count_unread(db, group_id, user_id, cursor)
+
+
+def _mark_group_read(
+    db: Session, group_id: int, user_id: int, message_id: int | None = None
+) -> tuple[int, int, list[int]]:
+    """推进已读游标，返回 (新读的消息数, 新的已读游标, 这次被读到消息的发送者)"""
+    cursor = _get_read_cursor(db, group_id, user_id)
+    if cursor is None:
+        raise HTTPException(403, "您不是该群成员")
     
-    # 统计该群中其他人发送的未读消息
-    count = db.scalar(
-        select(func.count(GroupMessage.id)).where(
+    # 只推进本成员的已读游标（单行更新），不改动消息表
+    latest = _latest_group_message_id(db, group_id)
+    target = latest if message_id is None else min(message_id, latest)
+    if target <= cursor:
+        return 0, cursor, []
+    updated_count = _count_unread(db, group_id, user_id, cursor, target)
+    sender_ids = db.scalars(
+        select(GroupMessage.sender_id)
+        .where(
             GroupMessage.group_id == group_id,
-            GroupMessage.sender_id != user_id,
-            GroupMessage.is_read == False
+            GroupMessage.id > cursor,
+            GroupMessage.id <= target,
+            GroupMessage.sender_id != user_id
         )
-    ) or 0
-    
-    return count
+        .distinct()
+    ).all()
+    db.execute(
+        update(GroupMember)
+        .where(GroupMember.group_id == group_id, GroupMember.user_id == user_id)
+        .values(last_read_message_id=func.greatest(GroupMember.last_read_message_id, target))
+    )
+    db.commit()
+    return updated_count, target, sender_ids
+
+
+async def mark_group_messages_read(db: Session, group_id: int, user_id: int, message_id: int | None = None) -> int:
+    """标记群消息为已读（读到 message_id 为止，不传则读到最新），返回新读的消息数（有上限）
+    
+    已读回执只推送给这次被读到的消息的发送者，客户端据此更新自己发出的、
+    id 不大于 last_read_message_id 的消息的已读人数
+    """
+    updated_count, last_read, sender_ids = await run_db(_mark_group_read, db, group_id, user_id, message_id)
+    if sender_ids:
+        await manager.fanout(sender_ids, {
+            "type": "group_read_receipt",
+            "data": {
+                "group_id": group_id,
+                "reader_id": user_id,
+                "last_read_message_id": last_read
+            }
+        })
+    return updated_count
 
 
-async def mark_group_GroupMessage_read(db: Session, group_id: int, user_id: int) -> int:
-    """标记群消息为已读"""
-    # 检查是否是群成员
-    member = db.scalar(
-        select(GroupMember).where(
-            GroupMember.group_id == group_id,
-            GroupMember.user_id == user_id
-        )
-    )
-    if not member:
-        raise HTTPException(403, "您不是该群成员")
+def get_group_read_by(
+    db: Session, group_id: int, user_id: int, message_ids: list[int], with_users: bool = False
+) -> list[GroupMessageReadBy]:
+    """一页群消息的已读情况
     
-    # 标记该群中其他人发送的消息为已读
-    updated_count = db.query(GroupMessage).filter(
-        GroupMessage.group_id == group_id,
-        GroupMessage.sender_id != user_id,
-        GroupMessage.is_read == False
-    ).update({"is_read": True}, synchronize_session=False)
+    不按 (消息, 成员) 逐条记录已读，而是由各成员的已读游标推算：
+    游标 >= 消息 id 的成员都读过这条消息。消息发出后才入群的成员（入群时最新消息 id >= 消息 id）不计入，
+    他们的游标从入群时的最新消息开始，必然也 >= 消息 id，所以直接从已读人数中减去。
+    游标和入群消息 id 各排一次序，每条消息的人数用二分查找得到，整页只需查一次成员、一次消息。
+    """
+    if get_member_role(db, group_id, user_id) is None:
+        raise HTTPException(403, "您不是该群成员")
+    if not message_ids:
+        return []
     
-    db.commit()
-    return updated_count
+    members = db.execute(
+        select(GroupMember.user_id, GroupMember.last_read_message_id, GroupMember.joined_message_id)
+        .where(GroupMember.group_id == group_id)
+        .order_by(GroupMember.last_read_message_id)
+    ).all()
+    cursors = [m.last_read_message_id for m in members]
+    joined = sorted(m.joined_message_id for m in members)
+    by_user = {m.user_id: m for m in members}
+    messages = db.execute(
+        select(GroupMessage.id, GroupMessage.sender_id)
+        .where(GroupMessage.group_id == group_id, GroupMessage.id.in_(message_ids))
+        .order_by(GroupMessage.id)
+    ).all()
+    
+    result = []
+    for msg in messages:
+        first_reader = bisect_left(cursors, msg.id)
+        # 消息发出时已在群里的成员数，以及其中读过的人数
+        member_count = bisect_left(joined, msg.id)
+        read_count = len(cursors) - first_reader - (len(joined) - member_count)
+        # 不含发送者
+        sender = by_user.get(msg.sender_id)
+        if sender is not None and sender.joined_message_id < msg.id:
+            member_count -= 1
+            if sender.last_read_message_id >= msg.id:
+                read_count -= 1
+        user_ids = None
+        if with_users:
+            user_ids = [
+                m.user_id for m in members[first_reader:]
+                if m.user_id != msg.sender_id and m.joined_message_id < msg.id
+            ]
+        result.append(GroupMessageReadBy(
+            message_id=msg.id,
+            read_count=read_count,
+            member_count=member_count,
+            user_ids=user_ids
+        ))
+    return result
@@ -1,16 +1,19 @@
 # services/message_service.py
 from typing import Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_, desc, func
-from app.models.messages import Messages
+from sqlalchemy import or_, and_, desc
+from app.models.messages import Messages, conversation_key
 from app.schemas.messages import MessageCreate, MessageResponse, Messagepage
+from app.db.database import run_db
+from app.core.pagination import paginate
+from app.services import conversation_service
 from app.websocket.manager import manager
 
 
 # --------------------------------------------------
 # 发送消息
 # --------------------------------------------------
-async def send_message_async(
+def _save_message(
     db: Session,
     sender_id: int,
     message_data: MessageCreate
@@ -18,13 +21,27 @@ async def send_message_async(
     new_message = Messages(
         sender_id=sender_id,
         receiver_id=message_data.receiver_id,
+        conversation_key=conversation_key(sender_id, message_data.receiver_id),
         content=message_data.content,
         msg_type=message_data.msg_type,
         is_read=False
     )
     db.add(new_message)
+    db.flush()
+    # 会话表（最近消息、未读数）与消息在同一事务中写入
+    conversation_service.record_message(db, sender_id, message_data.receiver_id, new_message.id)
     db.commit()
     db.refresh(new_message)
+    return new_message
+
+
+async def send_message_async(
+    db: Session,
+    sender_id: int,
+    message_data: MessageCreate
+) -> Messages:
+    # 写库在数据库线程池中执行，不阻塞事件循环
+    new_message = await run_db(_save_message, db, sender_id, message_data)
     
     # 推送消息给在线接收方
     if manager.is_online(message_data.receiver_id):
@@ -48,28 +65,21 @@ def get_chat_history(
     current_user_id: int,
     peer_user_id: int,
     last_id: Optional[int] = None,
-    limit: int = 99
+    limit: int = 99,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    around: Optional[int] = None
 ) -> Messagepage:
+    # 按 (conversation_key, id) 索引做一次范围扫描，id 与发送顺序一致（分页模式见 core/pagination.py）
     query = db.query(Messages).filter(
-        or_(
-            and_(Messages.sender_id == current_user_id, Messages.receiver_id == peer_user_id),
-            and_(Messages.sender_id == peer_user_id, Messages.receiver_id == current_user_id)
-        )
+        Messages.conversation_key == conversation_key(current_user_id, peer_user_id)
+    )
+    messages, page = paginate(
+        query, Messages.id, limit, before=before, after=after, around=around, last_id=last_id
     )
-    if last_id:
-        query = query.filter(Messages.id < last_id)
-
-    messages = query.order_by(desc(Messages.created_at)).limit(limit + 1).all()
-
-    has_more = len(messages) > limit
-    if has_more:
-        messages = messages[:limit]
-
-    last_message_id = messages[-1].id if messages else None
     return Messagepage(
         items=[MessageResponse.model_validate(msg) for msg in messages],
-        has_more=has_more,
-        last_id=last_message_id
+        **page
     )
 
 
@@ -81,27 +91,34 @@ def get_unread_count(
     current_user_id: int,
     peer_user_id: int
 ) -> int:
-    return db.query(Messages).filter(
-        Messages.receiver_id == current_user_id,
-        Messages.sender_id == peer_user_id,
-        Messages.is_read == False
-    ).count()
+    # 未读数由会话表维护，不再 COUNT 消息表
+    return conversation_service.get_unread_count(db, current_user_id, peer_user_id)
 
 
 # --------------------------------------------------
 # 标记与某人的所有消息为已读
 # --------------------------------------------------
-async def mark_as_read_async(
+def _mark_as_read(
     db: Session,
     current_user_id: int,
     peer_user_id: int
 ) -> int:
     updated_count = db.query(Messages).filter(
+        Messages.conversation_key == conversation_key(current_user_id, peer_user_id),
         Messages.receiver_id == current_user_id,
-        Messages.sender_id == peer_user_id,
         Messages.is_read == False
     ).update({"is_read": True}, synchronize_session=False)
+    conversation_service.clear_unread(db, current_user_id, peer_user_id)
     db.commit()
+    return updated_count
+
+
+async def mark_as_read_async(
+    db: Session,
+    current_user_id: int,
+    peer_user_id: int
+) -> int:
+    updated_count = await run_db(_mark_as_read, db, current_user_id, peer_user_id)
     
     # 推送已读回执给对方
     if updated_count > 0 and manager.is_online(peer_user_id):
@@ -126,10 +143,7 @@ def get_total_unread_count(
     db: Session,
     current_user_id: int
 ) -> int:
-    return db.query(Messages).filter(
-        Messages.receiver_id == current_user_id,
-        Messages.is_read == False
-    ).count()
+    return conversation_service.get_total_unread_count(db, current_user_id)
 
 
 # --------------------------------------------------
@@ -139,14 +153,7 @@ def get_unread_counts_by_user(
     db: Session,
     current_user_id: int
 ) -> dict[int, int]:
-    rows = db.query(
-        Messages.sender_id,
-        func.count(Messages.id).label("unread_count")
-    ).filter(
-        Messages.receiver_id == current_user_id,
-        Messages.is_read == False
-    ).group_by(Messages.sender_id).all()
-    return {sender_id: cnt for sender_id, cnt in rows}
+    return conversation_service.get_unread_counts_by_peer(db, current_user_id)
 
 
 # --------------------------------------------------
@@ -164,6 +171,9 @@ def delete_message(
     if not msg:
         return False
 
+    # 对方还没读的消息撤回后不再计入会话未读数（已撤回过的不重复扣减；is_read 保持不变）
+    if not msg.is_read and msg.msg_type != 4:
+        conversation_service.decrement_unread(db, msg.receiver_id, msg.sender_id)
     # 软撤回：标记类型+替换内容
     msg.msg_type = 4
     msg.content = "[消息已撤回]"
@@ -0,0 +1,137 @@
+# services/presence_store.py
+"""实时在线状态存储（write-behind）
+
+内存中的状态是 users.status / users.last_seen 的权威来源：
+上线、下线、登录、登出只改内存并标记为脏，后台任务定期把脏数据
+批量 UPDATE 回 MySQL，应用关闭时再落一次盘。
+多 worker 时通过消息总线同步状态，各 worker 读到的实时状态一致。
+下线状态写入数据库后即从内存移除（之后读数据库中的值），内存只保留在线和待回写的用户。
+"""
+from datetime import datetime, timedelta
+from typing import Dict
+from sqlalchemy import update
+from app.models.user import User
+from app.core.config import settings
+from app.db.database import db_executor
+from app.websocket.manager import manager
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceStore:
+    """内存在线状态 + 定期批量回写"""
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        # {user_id: (status, last_seen)}
+        self._states: Dict[int, tuple[str, datetime | None]] = {}
+        # 待回写的 user_id
+        self._dirty: set[int] = set()
+        # 其他 worker 同步来的下线状态（由对方回写），隔一个回写周期后移除: 本周期 / 上周期
+        self._remote_offline: Dict[int, tuple[str, datetime | None]] = {}
+        self._remote_offline_prev: Dict[int, tuple[str, datetime | None]] = {}
+        self._lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+
+    def set_status(self, user_id: int, status: str):
+        """更新用户状态（'online' / 'offline'），不直接写库"""
+        last_seen = datetime.utcnow() + timedelta(hours=8) if status == "offline" else None
+        with self._lock:
+            self._states[user_id] = (status, last_seen)
+            self._dirty.add(user_id)
+        manager.publish_event("presence_state", {
+            "user_id": user_id,
+            "status": status,
+            "last_seen": last_seen.isoformat() if last_seen else None
+        })
+
+    def apply_remote(self, user_id: int, status: str, last_seen: datetime | None):
+        """应用其他 worker 同步来的状态：只更新内存，由发生变化的 worker 负责写库"""
+        with self._lock:
+            self._states[user_id] = (status, last_seen)
+            if status == "offline":
+                self._remote_offline[user_id] = (status, last_seen)
+
+    def resolve(self, user: User) -> tuple[str, datetime | None]:
+        """返回用户的实时 (status, last_seen)，内存中没有时使用数据库中的值"""
+        state = self._states.get(user.id)
+        if state is None:
+            return getattr(user, "status", "offline") or "offline", user.last_seen
+        return state
+
+    def flush(self) -> int:
+        """把脏数据批量写回数据库（同步，在数据库线程池中执行），返回写入行数"""
+        from app.db.database import SessionLocal
+
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = [
+                {"id": uid, "status": self._states[uid][0], "last_seen": self._states[uid][1]}
+                for uid in dirty
+            ]
+            expired, self._remote_offline_prev = self._remote_offline_prev, self._remote_offline
+            self._remote_offline = {}
+            self._evict(expired)
+        if not rows:
+            return 0
+
+        db = SessionLocal()
+        try:
+            db.execute(update(User), rows)
+            db.commit()
+            with self._lock:
+                self._evict({
+                    row["id"]: (row["status"], row["last_seen"])
+                    for row in rows if row["status"] == "offline"
+                })
+            return len(rows)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"[presence] 批量回写在线状态失败: {e}")
+            # 放回脏集合，下次重试
+            with self._lock:
+                self._dirty |= dirty
+            return 0
+        finally:
+            db.close()
+
+    def _evict(self, states: Dict[int, tuple[str, datetime | None]]):
+        """移除已落库的下线状态（调用方持有锁）；期间状态又变化或待回写的保留"""
+        for uid, state in states.items():
+            if uid not in self._dirty and self._states.get(uid) == state:
+                del self._states[uid]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await loop.run_in_executor(db_executor, self.flush)
+
+    async def start(self):
+        """启动定期回写任务（在应用 lifespan 中调用）"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止定期回写，并把剩余的脏数据落盘"""
+        if self._task:
+            self._task.cancel()
+        count = await asyncio.get_running_loop().run_in_executor(db_executor, self.flush)
+        logger.info(f"[presence] 关闭前回写 {count} 条在线状态")
+
+
+# 全局单例
+presence_store = PresenceStore(settings.PRESENCE_FLUSH_INTERVAL)
+
+
+async def _on_presence_state(source: str, payload: dict, body: bytes | None):
+    last_seen = payload["last_seen"]
+    presence_store.apply_remote(
+        payload["user_id"],
+        payload["status"],
+        datetime.fromisoformat(last_seen) if last_seen else None
+    )
+
+manager.bus.subscribe("presence_state", _on_presence_state)
@@ -0,0 +1,156 @@
+# services/sync_service.py
+"""离线消息同步
+
+客户端维护一个同步游标（不透明字符串，内部是已收到的最大私聊消息 id 和最大群消息 id），
+重连时带在 /ws?cursor= 上，服务端在 connected 之后按 id 顺序分页推送游标之后的
+所有私聊和群消息，最后发送 sync_done，其中带有新的游标。
+
+    - 不带 cursor 参数: 不同步（老客户端）
+    - cursor 为空或无效: 不推送消息，sync_done 中返回当前最新游标（reset=true）
+    - 离线太久、积压超过 WS_SYNC_MAX_MESSAGES 条: 推送到上限为止，sync_done 中 truncated=true，
+      剩余部分由客户端通过历史记录接口补齐
+
+连接在同步开始前就已注册，同步期间的新消息会同时实时推送，客户端按消息 id 去重即可；
+之后收到的实时消息也按 id 推进游标。
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import select, func, union
+from app.models.messages import Messages
+from app.models.group_messages import GroupMessage
+from app.models.group_members import GroupMember
+from app.schemas.messages import MessageResponse
+from app.schemas.group_messages import GroupMessageResponse
+from app.websocket.connection import Connection
+from app.core.config import settings
+from app.db.database import run_db
+import asyncio
+import base64
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== 游标 ====================
+
+def encode_cursor(private_id: int, group_id: int) -> str:
+    raw = f"{private_id}:{group_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[int, int]:
+    """解析游标，返回 (私聊消息 id, 群消息 id)，无效时抛 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        private_id, group_id = (int(part) for part in raw.split(":"))
+    except Exception as e:
+        raise ValueError(f"无效的同步游标: {cursor}") from e
+    if private_id < 0 or group_id < 0:
+        raise ValueError(f"无效的同步游标: {cursor}")
+    return private_id, group_id
+
+
+def get_head_cursor(db: Session) -> str:
+    """当前最新的游标（两张表的最大 id）"""
+    private_id = db.scalar(select(func.max(Messages.id))) or 0
+    group_id = db.scalar(select(func.max(GroupMessage.id))) or 0
+    return encode_cursor(private_id, group_id)
+
+
+# ==================== 分页查询 ====================
+
+def get_user_group_ids(db: Session, user_id: int) -> list[int]:
+    return db.execute(
+        select(GroupMember.group_id).where(GroupMember.user_id == user_id)
+    ).scalars().all()
+
+
+def get_missed_private(db: Session, user_id: int, after_id: int, limit: int) -> list[Messages]:
+    """游标之后与该用户相关的私聊消息（包括自己在其他设备上发出的）
+
+    收到的和发出的分别在 receiver_id / sender_id 索引（InnoDB 二级索引带主键，即 (列, id)）
+    上做范围扫描、各取 limit 条，合并后再取前 limit 条，避免 OR 条件退化成索引合并或全表扫描
+    """
+    def _side(column):
+        return select(Messages.id).where(column == user_id, Messages.id > after_id).order_by(Messages.id).limit(limit)
+
+    received = _side(Messages.receiver_id).subquery()
+    sent = _side(Messages.sender_id).subquery()
+    ids = union(select(received.c.id), select(sent.c.id)).subquery()
+    return db.execute(
+        select(Messages)
+        .join(ids, Messages.id == ids.c.id)
+        .order_by(Messages.id)
+        .limit(limit)
+    ).scalars().all()
+
+
+def get_missed_group(db: Session, group_ids: list[int], after_id: int, limit: int) -> list[GroupMessage]:
+    """游标之后这些群里的群消息"""
+    if not group_ids:
+        return []
+    return db.execute(
+        select(GroupMessage)
+        .where(GroupMessage.group_id.in_(group_ids), GroupMessage.id > after_id)
+        .order_by(GroupMessage.id)
+        .limit(limit)
+    ).scalars().all()
+
+
+# ==================== 推送 ====================
+
+async def stream_missed_messages(db: Session, connection: Connection, cursor: str):
+    """按页推送游标之后的离线消息，最后发送 sync_done（查询在数据库线程池中执行）"""
+    try:
+        private_id, group_id = decode_cursor(cursor)
+    except ValueError:
+        connection.send_message({
+            "type": "sync_done",
+            "data": {"cursor": await run_db(get_head_cursor, db), "reset": True, "truncated": False}
+        })
+        return
+
+    user_id = connection.user_id
+    group_ids = await run_db(get_user_group_ids, db, user_id)
+
+    page_size = settings.WS_SYNC_PAGE_SIZE
+    remaining = settings.WS_SYNC_MAX_MESSAGES
+    private_done = group_done = False
+    pages = sent = 0
+
+    while not (private_done and group_done) and remaining > 0:
+        # 两张表共用剩余额度，群消息只取私聊取完后剩下的部分，不超过上限
+        private_limit = min(page_size, remaining)
+        private = [] if private_done else await run_db(get_missed_private, db, user_id, private_id, private_limit)
+        group_limit = min(page_size, remaining - len(private))
+        group = [] if group_done or group_limit == 0 else await run_db(
+            get_missed_group, db, group_ids, group_id, group_limit
+        )
+        private_done = private_done or len(private) < private_limit
+        group_done = group_done or len(group) < group_limit
+
+        if private:
+            private_id = private[-1].id
+        if group:
+            group_id = group[-1].id
+        sent += len(private) + len(group)
+        remaining -= len(private) + len(group)
+
+        if private or group:
+            pages += 1
+            connection.send_message({
+                "type": "sync_messages",
+                "data": {
+                    "private": [MessageResponse.model_validate(m).model_dump(mode='json') for m in private],
+                    "group": [GroupMessageResponse.model_validate(m).model_dump(mode='json') for m in group],
+                    "cursor": encode_cursor(private_id, group_id)
+                }
+            })
+            # 每页之间让出事件循环，让写协程先把这一页发出去
+            await asyncio.sleep(0)
+
+    truncated = not (private_done and group_done)
+    connection.send_message({
+        "type": "sync_done",
+        "data": {"cursor": encode_cursor(private_id, group_id), "reset": False, "truncated": truncated}
+    })
+    logger.info(f"用户 {user_id} 离线同步完成: {pages} 页，{sent} 条消息，截断: {truncated}")
@@ -0,0 +1,144 @@
+"""/ws 新连接准入控制
+
+发版或网络抖动后，成千上万个客户端会同时重连，每个连接都要验 token、开数据库会话、
+查联系人、更新在线状态，全部同时涌入会把数据库和事件循环一起压垮。
+
+- 令牌桶：每秒最多放行 WS_ADMIT_RATE 个新连接，允许 WS_ADMIT_BURST 的突发
+- 排队：拿不到令牌的连接排队等待，最多等 WS_ADMIT_MAX_WAIT 秒
+- 拒绝：队列满或等待超时时，告诉客户端多久后重试（按队列长度估算再加随机抖动，
+  把下一波重连打散），并以 1013（Try Again Later）关闭
+- 优先通道：带有效断线重连令牌（resume token）的连接排在普通连接前面，
+  保证已经在线的用户网络抖动后能最先恢复；优先通道同样最多排 WS_ADMIT_QUEUE_SIZE 个，
+  令牌被重放也绕不过准入上限
+"""
+from collections import deque
+from fastapi import WebSocket
+import asyncio
+import json
+import logging
+import random
+import time
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 准入被拒绝时的关闭码（1013: Try Again Later）
+RETRY_CLOSE_CODE = 1013
+
+
+class AdmissionController:
+    """令牌桶 + 两级排队"""
+
+    def __init__(self, rate: float, burst: int, queue_size: int, max_wait: float, jitter: float):
+        self.rate = rate
+        self.burst = burst
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.jitter = jitter
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        # 等待中的连接: (优先通道, 普通通道)
+        self._lanes: tuple[deque[asyncio.Future], deque[asyncio.Future]] = (deque(), deque())
+        self._pump_task: asyncio.Task | None = None
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def waiting(self) -> int:
+        return len(self._lanes[0]) + len(self._lanes[1])
+
+    async def admit(self, priority: bool = False) -> float | None:
+        """申请放行一个新连接
+
+        Returns:
+            None 表示放行；否则为建议客户端等待多少秒后重试
+        """
+        self._refill()
+        if self._tokens >= 1 and not self.waiting:
+            self._tokens -= 1
+            self.admitted += 1
+            return None
+
+        # 普通连接按总排队数限制（优先通道排满时也不再接收普通连接），优先通道单独限制
+        if (len(self._lanes[0]) if priority else self.waiting) >= self.queue_size:
+            return self._reject()
+
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[0 if priority else 1].append(future)
+        self.queued += 1
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            return self._reject()
+        self.admitted += 1
+        return None
+
+    def _next_waiter(self) -> asyncio.Future | None:
+        for lane in self._lanes:
+            while lane:
+                future = lane.popleft()
+                # 已超时放弃的跳过
+                if not future.done():
+                    return future
+        return None
+
+    async def _pump(self):
+        """按令牌桶速率依次放行排队的连接，优先通道先放行"""
+        while self.waiting:
+            self._refill()
+            while self._tokens >= 1:
+                future = self._next_waiter()
+                if future is None:
+                    break
+                self._tokens -= 1
+                future.set_result(None)
+            if self.waiting:
+                await asyncio.sleep(max(1 - self._tokens, 0) / self.rate)
+
+    def _reject(self) -> float:
+        self.rejected += 1
+        return round(self.waiting / self.rate + random.uniform(0, self.jitter), 1)
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "tokens": round(self._tokens, 1),
+            "waiting_priority": len(self._lanes[0]),
+            "waiting": len(self._lanes[1]),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected
+        }
+
+
+async def reject(websocket: WebSocket, retry_after: float):
+    """告诉客户端稍后重试并关闭连接（尚未建立 Connection，直接发 JSON 文本帧）"""
+    try:
+        await websocket.accept()
+        await websocket.send_text(json.dumps({
+            "type": "retry_after",
+            "data": {"retry_after": retry_after, "reason": "服务器繁忙，请稍后重连"}
+        }, ensure_ascii=False))
+        await websocket.close(code=RETRY_CLOSE_CODE, reason="服务器繁忙")
+    except Exception as e:
+        logger.debug(f"拒绝连接时出错: {e}")
+
+
+# 全局单例
+admission = AdmissionController(
+    rate=settings.WS_ADMIT_RATE,
+    burst=settings.WS_ADMIT_BURST,
+    queue_size=settings.WS_ADMIT_QUEUE_SIZE,
+    max_wait=settings.WS_ADMIT_MAX_WAIT,
+    jitter=settings.WS_ADMIT_RETRY_JITTER
+)
@@ -0,0 +1,232 @@
+"""WebSocket 跨 worker 消息总线
+
+多 worker 部署时，每个 worker 只持有连到自己身上的 WebSocket。
+总线负责在 worker 之间转发事件（投递消息、在线状态、通话映射等），
+让 ConnectionManager 在任意 worker 上都能把消息送到目标用户。
+
+后端：
+    - LocalBus: 进程内总线，单 worker 部署（默认）
+    - UnixSocketBus: 同一台 Linux 主机上的多 worker，基于 Unix Domain Socket，不依赖外部服务
+"""
+import asyncio
+import json
+import logging
+import os
+import struct
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 处理函数签名: (来源 worker_id, 负载, 二进制数据)
+Handler = Callable[[str, dict, Optional[bytes]], Awaitable[None]]
+
+# 内部主题：对端 worker 上线 / 失联
+PEER_JOINED = "__peer_joined__"
+PEER_LOST = "__peer_lost__"
+
+# 帧头: header 长度 + body 长度（大端无符号 32 位）
+_FRAME_HEAD = struct.Struct(">II")
+
+
+class MessageBus:
+    """消息总线基类"""
+
+    def __init__(self):
+        # 当前 worker 的唯一标识
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, Handler] = {}
+
+    def subscribe(self, topic: str, handler: Handler):
+        """注册主题处理函数（每个主题一个）"""
+        self._handlers[topic] = handler
+
+    async def start(self):
+        """启动总线"""
+
+    async def stop(self):
+        """关闭总线"""
+
+    async def publish(self, topic: str, payload: dict, body: bytes | None = None):
+        """广播事件给其他所有 worker（不包括自己）"""
+
+    async def send_to(self, worker_id: str, topic: str, payload: dict, body: bytes | None = None) -> bool:
+        """投递事件给指定 worker，返回是否投递成功"""
+        return False
+
+    async def _dispatch(self, source: str, topic: str, payload: dict, body: bytes | None):
+        handler = self._handlers.get(topic)
+        if handler is None:
+            return
+        try:
+            await handler(source, payload, body)
+        except Exception as e:
+            logger.error(f"处理总线事件 {topic} 失败: {e}")
+
+
+class LocalBus(MessageBus):
+    """进程内总线
+
+    单 worker 时没有对端，publish 直接返回；
+    同一进程内创建的多个 LocalBus 会互相视为对端（便于本地调试多 worker 行为）。
+    """
+
+    _instances: Dict[str, "LocalBus"] = {}
+
+    async def start(self):
+        for peer in list(self._instances.values()):
+            await peer._dispatch(self.worker_id, PEER_JOINED, {}, None)
+        self._instances[self.worker_id] = self
+
+    async def stop(self):
+        self._instances.pop(self.worker_id, None)
+        for peer in list(self._instances.values()):
+            await peer._dispatch(self.worker_id, PEER_LOST, {}, None)
+
+    async def publish(self, topic: str, payload: dict, body: bytes | None = None):
+        for worker_id in list(self._instances):
+            if worker_id != self.worker_id:
+                await self.send_to(worker_id, topic, payload, body)
+
+    async def send_to(self, worker_id: str, topic: str, payload: dict, body: bytes | None = None) -> bool:
+        peer = self._instances.get(worker_id)
+        if peer is None:
+            return False
+        await peer._dispatch(self.worker_id, topic, payload, body)
+        return True
+
+
+class UnixSocketBus(MessageBus):
+    """基于 Unix Domain Socket 的单机多 worker 总线
+
+    每个 worker 在 bus_dir 下监听 <worker_id>.sock，
+    启动时扫描目录连接其他 worker 并发送 hello，之后按需复用长连接。
+    帧格式: [header_len][body_len][header json][body]
+    """
+
+    def __init__(self, bus_dir: str):
+        super().__init__()
+        self.bus_dir = bus_dir
+        self.path = os.path.join(bus_dir, f"{self.worker_id}.sock")
+        self._server: asyncio.AbstractServer | None = None
+        # 对端连接: {worker_id: StreamWriter}
+        self._writers: Dict[str, asyncio.StreamWriter] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # 对端连进来的连接（关闭时一并断开）
+        self._inbound: set[asyncio.StreamWriter] = set()
+
+    async def start(self):
+        os.makedirs(self.bus_dir, exist_ok=True)
+        self._server = await asyncio.start_unix_server(self._handle_peer, path=self.path)
+        logger.info(f"[bus] worker {self.worker_id} 监听 {self.path}")
+
+        # 发现已有的 worker 并打招呼
+        for name in os.listdir(self.bus_dir):
+            if not name.endswith(".sock"):
+                continue
+            worker_id = name[:-len(".sock")]
+            if worker_id != self.worker_id and await self.send_to(worker_id, "__hello__", {}):
+                await self._dispatch(worker_id, PEER_JOINED, {}, None)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+        for writer in self._inbound:
+            writer.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def publish(self, topic: str, payload: dict, body: bytes | None = None):
+        for worker_id in list(self._writers):
+            await self.send_to(worker_id, topic, payload, body)
+
+    async def send_to(self, worker_id: str, topic: str, payload: dict, body: bytes | None = None) -> bool:
+        header = json.dumps(
+            {"src": self.worker_id, "topic": topic, "payload": payload},
+            ensure_ascii=False
+        ).encode("utf-8")
+        body = body or b""
+        frame = _FRAME_HEAD.pack(len(header), len(body)) + header + body
+
+        lock = self._locks.setdefault(worker_id, asyncio.Lock())
+        async with lock:
+            try:
+                writer = self._writers.get(worker_id)
+                if writer is None:
+                    writer = await self._open(worker_id)
+                writer.write(frame)
+                await writer.drain()
+                return True
+            except (OSError, ConnectionError) as e:
+                logger.warning(f"[bus] 向 worker {worker_id} 投递失败: {e}")
+                await self._drop_peer(worker_id)
+                return False
+
+    async def _open(self, worker_id: str) -> asyncio.StreamWriter:
+        path = os.path.join(self.bus_dir, f"{worker_id}.sock")
+        try:
+            _, writer = await asyncio.open_unix_connection(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # 对端已退出，清理残留的 socket 文件
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            raise
+        self._writers[worker_id] = writer
+        return writer
+
+    async def _drop_peer(self, worker_id: str):
+        writer = self._writers.pop(worker_id, None)
+        if writer is None:
+            return
+        writer.close()
+        await self._dispatch(worker_id, PEER_LOST, {}, None)
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """读取对端发来的帧"""
+        self._inbound.add(writer)
+        source = None
+        try:
+            while True:
+                head = await reader.readexactly(_FRAME_HEAD.size)
+                header_len, body_len = _FRAME_HEAD.unpack(head)
+                header = json.loads(await reader.readexactly(header_len))
+                body = await reader.readexactly(body_len) if body_len else None
+
+                source = header["src"]
+                topic = header["topic"]
+                if topic == "__hello__":
+                    # 新 worker 上线：建立反向连接并通知上层同步状态
+                    if source not in self._writers:
+                        try:
+                            await self._open(source)
+                        except OSError as e:
+                            logger.warning(f"[bus] 连接新 worker {source} 失败: {e}")
+                            continue
+                    await self._dispatch(source, PEER_JOINED, {}, None)
+                    continue
+                await self._dispatch(source, topic, header["payload"], body)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"[bus] 读取对端数据出错: {e}")
+        finally:
+            self._inbound.discard(writer)
+            writer.close()
+            if source:
+                await self._drop_peer(source)
+
+
+def create_bus(backend: str, bus_dir: str) -> MessageBus:
+    """根据配置创建总线"""
+    if backend == "unix":
+        return UnixSocketBus(bus_dir)
+    if backend != "local":
+        logger.warning(f"[bus] 未知的总线后端 {backend}，使用 local")
+    return LocalBus()
@@ -0,0 +1,181 @@
+"""WebSocket 帧编码
+
+客户端在握手时通过 caps 声明编码：
+    - json（默认）: 事件为 JSON 文本帧，音频为原始二进制帧（兼容老客户端）
+    - msgpack: 全部使用二进制帧，首字节为帧类型：
+        0x01 事件（MessagePack 编码的对象）
+        0x02 音频（后面是原始音频数据）
+        0x03 批量事件（MessagePack 数组）
+      客户端发给服务端的二进制帧使用同样的前缀；文本帧仍按 JSON 解析
+
+压缩由 WebSocket 的 permessage-deflate 扩展在握手时协商（见 start.py），与编码无关。
+
+音频不复制：msgpack 客户端发来的音频帧以跳过前缀的 memoryview 交给转发器，
+转发给同样使用 msgpack 的客户端时直接发送原始帧（前缀原样保留）；
+只有两端编码不同时才需要去掉 / 加上前缀（复制一次）。
+
+每条消息在推送时包装成 EncodedMessage，按连接使用的编码惰性编码并缓存，
+同一条消息扇出给成千上万个连接时每种编码只编码一次；需要确认的消息
+再由 with_seq 在编码好的帧前拼上各连接自己的序号（见 delivery.py），不重新序列化。
+"""
+from typing import Dict
+import json
+
+try:
+    import msgpack
+except ImportError:  # 未安装 msgpack 时只支持 JSON
+    msgpack = None
+
+# 二进制帧类型（msgpack 编码下的首字节）
+FRAME_EVENT = 0x01
+FRAME_AUDIO = 0x02
+FRAME_BATCH = 0x03
+
+CAP_MSGPACK = "msgpack"
+
+
+class CodecError(ValueError):
+    """客户端帧无法解码"""
+
+
+class JsonCodec:
+    """JSON 文本帧"""
+
+    name = "json"
+
+    def encode(self, message: dict) -> str:
+        return json.dumps(message, ensure_ascii=False)
+
+    def decode(self, data: str | bytes) -> dict:
+        return json.loads(data)
+
+    def event_frame(self, frame: str) -> str:
+        return frame
+
+    def with_seq(self, frame: str, seq: int) -> str:
+        # 帧是一个 JSON 对象，在开头插入 seq 字段
+        return f'{{"seq": {seq}, ' + frame[1:]
+
+    def batch_frame(self, frames: list[str]) -> str:
+        # 每个事件已是编码好的 JSON，直接拼接，不再重新序列化
+        return "[" + ",".join(frames) + "]"
+
+    def audio_frame(self, data: bytes | memoryview) -> bytes:
+        # 来自 msgpack 客户端的音频（去掉前缀后的 memoryview）需要转成 bytes 发送
+        return bytes(data) if isinstance(data, memoryview) else data
+
+    def split_binary(self, data: bytes) -> tuple[int, bytes]:
+        # 老协议中客户端发来的二进制帧都是音频
+        return FRAME_AUDIO, data
+
+
+class MsgpackCodec:
+    """带一字节帧类型前缀的 MessagePack 二进制帧"""
+
+    name = "msgpack"
+
+    def __init__(self):
+        self._packer = msgpack.Packer()
+
+    def encode(self, message: dict) -> bytes:
+        return self._packer.pack(message)
+
+    def decode(self, data: str | bytes) -> dict:
+        if isinstance(data, str):
+            return json.loads(data)
+        try:
+            return msgpack.unpackb(data)
+        except Exception as e:
+            raise CodecError(f"无效的 MessagePack 数据: {e}") from e
+
+    def event_frame(self, frame: bytes) -> bytes:
+        return bytes((FRAME_EVENT,)) + frame
+
+    def with_seq(self, frame: bytes, seq: int) -> bytes:
+        head = frame[0]
+        if 0x80 <= head < 0x8f:
+            # fixmap：元素个数加一，在开头插入 seq 键值对
+            return bytes((head + 1,)) + self._packer.pack("seq") + self._packer.pack(seq) + frame[1:]
+        return self.encode({"seq": seq, **msgpack.unpackb(frame)})
+
+    def batch_frame(self, frames: list[bytes]) -> bytes:
+        # MessagePack 数组 = 数组头 + 依次拼接的元素，同样无需重新序列化
+        return bytes((FRAME_BATCH,)) + self._packer.pack_array_header(len(frames)) + b"".join(frames)
+
+    def audio_frame(self, data: bytes | memoryview) -> bytes:
+        if isinstance(data, memoryview):
+            # 来自 msgpack 客户端：原始帧就是带音频前缀的完整帧，原样转发
+            original = data.obj
+            if isinstance(original, bytes) and len(original) == len(data) + 1 and original[0] == FRAME_AUDIO:
+                return original
+            data = bytes(data)
+        return bytes((FRAME_AUDIO,)) + data
+
+    def split_binary(self, data: bytes) -> tuple[int, bytes | memoryview]:
+        if not data:
+            return 0, b""
+        # 只去掉前缀，不复制数据
+        return data[0], memoryview(data)[1:]
+
+
+JSON_CODEC = JsonCodec()
+MSGPACK_CODEC = MsgpackCodec() if msgpack else None
+
+
+def available_caps() -> set[str]:
+    """当前环境支持的编码相关能力"""
+    return {CAP_MSGPACK} if msgpack else set()
+
+
+def get_codec(caps: frozenset[str]):
+    """根据客户端声明的能力选择编码"""
+    if CAP_MSGPACK in caps and MSGPACK_CODEC:
+        return MSGPACK_CODEC
+    return JSON_CODEC
+
+
+class EncodedMessage:
+    """一条待推送的消息，按编码惰性编码并缓存"""
+
+    __slots__ = ("message", "kind", "key", "acked", "requires", "fallback", "_frames")
+
+    def __init__(
+        self,
+        message: dict | None,
+        kind: str,
+        json_frame: str | None = None,
+        key: str | None = None,
+        acked: bool = False,
+        requires: str | None = None,
+        fallback: list["EncodedMessage"] | None = None
+    ):
+        self.message = message
+        self.kind = kind
+        # 合并键：发送队列中键相同的在线状态事件只保留最新一条（见 connection.collapse_key）
+        self.key = key
+        # 需要客户端确认，推送时带序号并进入未确认窗口（见 delivery.py）
+        self.acked = acked
+        # 只发给声明了 requires 能力的连接，其他连接改为依次发送 fallback 中的消息（兼容老客户端）
+        self.requires = requires
+        self.fallback = fallback or []
+        # {编码名: 帧}
+        self._frames: Dict[str, str | bytes] = {}
+        if json_frame is not None:
+            self._frames[JSON_CODEC.name] = json_frame
+
+    @classmethod
+    def from_json(cls, frame: str, kind: str, key: str | None = None, acked: bool = False) -> "EncodedMessage":
+        """由已编码的 JSON 帧构造（其他 worker 经总线转发来的消息）"""
+        return cls(None, kind, json_frame=frame, key=key, acked=acked)
+
+    @property
+    def json(self) -> str:
+        return self.frame(JSON_CODEC)
+
+    def frame(self, codec) -> str | bytes:
+        frame = self._frames.get(codec.name)
+        if frame is None:
+            if self.message is None:
+                self.message = json.loads(self._frames[JSON_CODEC.name])
+            frame = self._frames[codec.name] = codec.encode(self.message)
+        return frame
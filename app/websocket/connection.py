@@ -0,0 +1,342 @@
+"""单个 WebSocket 连接的发送端
+
+每个连接持有一个有界发送队列和一个独立的写协程：
+生产者（HTTP 请求、群消息扇出、在线状态广播）只负责入队，立即返回，
+真正的 send_text / send_bytes 由写协程串行完成，慢客户端只会拖慢自己。
+
+发送队列按优先级分道（通话信令 > 音频 > 普通消息 > 在线状态），写协程总是先发
+高优先级道里的帧，群聊突发时来电也能立即送达；同一道内保持先进先出。
+在线状态道里同一个用户的状态变化只保留最新一条（见 collapse_key），
+积压时不会把一串已经过时的上线 / 下线依次推给客户端。
+
+队列满时的溢出策略（上限按所有道的总数计算）：
+    - 通话信令（call）: 永不丢弃，允许超出上限
+    - 音频（audio）: 单独的环形缓冲（audio_ring 帧），满了挤掉最旧的一帧，不受总数上限限制
+    - 在线状态 / 心跳（presence）: 直接丢弃；在线状态和音频都会优先被挤出队列
+    - 普通消息（chat）: 先挤掉队列中最早的在线状态 / 音频；挤不出来就丢弃并记一次违规，
+      连续违规达到上限视为慢客户端，断开连接（客户端重连后可从历史记录补齐）
+
+批量推送（客户端在握手时声明 caps=batch）：
+    写协程被唤醒后先等待一个很短的合并窗口，再按优先级从各道取出事件
+    拼成一个数组一次发出（JSON 编码下帧以 "[" 开头即为批量帧），
+    减少突发流量下的帧数、系统调用和移动端射频唤醒。通话信令和音频不等待窗口。
+
+帧的编码（JSON / MessagePack）由握手时协商的 codec 决定，见 codec.py。
+
+需要确认的消息（ACKED_TYPES）入队时分配本设备会话的序号并记入未确认窗口，
+窗口在重连时重放，见 delivery.py。
+"""
+from collections import deque
+from fastapi import WebSocket
+from app.websocket.codec import EncodedMessage, available_caps, get_codec
+from app.websocket.delivery import DeliveryWindow
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 事件类别
+KIND_CALL = "call"
+KIND_CHAT = "chat"
+KIND_PRESENCE = "presence"
+KIND_AUDIO = "audio"
+
+# 可以被丢弃的类别
+DROPPABLE_KINDS = {KIND_PRESENCE, KIND_AUDIO}
+
+PRESENCE_TYPES = {"user_online", "user_offline", "user_status_batch", "online_users", "ping", "pong"}
+
+# 需要客户端确认的消息类型
+ACKED_TYPES = {"new_message", "new_group_message"}
+
+# 不等待合并窗口、立即发送的类别
+URGENT_KINDS = {KIND_CALL, KIND_AUDIO}
+
+# 发送队列的优先级（从高到低）
+LANES = (KIND_CALL, KIND_AUDIO, KIND_CHAT, KIND_PRESENCE)
+
+# 客户端能力（/ws?caps=batch,...）
+CAP_BATCH = "batch"
+# 能处理合并后的在线状态 user_status_batch，未声明的连接仍逐条收到 user_online / user_offline
+CAP_PRESENCE_BATCH = "presence_batch"
+SUPPORTED_CAPS = {CAP_BATCH, CAP_PRESENCE_BATCH} | available_caps()
+
+# 慢客户端被断开时使用的关闭码（1013: Try Again Later）
+LAGGARD_CLOSE_CODE = 1013
+
+
+def classify(message_type: str | None) -> str:
+    """根据消息 type 判断事件类别"""
+    if message_type and message_type.startswith("voice_call_"):
+        return KIND_CALL
+    if message_type in PRESENCE_TYPES:
+        return KIND_PRESENCE
+    return KIND_CHAT
+
+
+def collapse_key(message: dict) -> str | None:
+    """在线状态事件的合并键：键相同的事件在发送队列中只保留最新一条"""
+    message_type = message.get("type")
+    if message_type in ("user_online", "user_offline"):
+        return f"user:{(message.get('data') or {}).get('user_id')}"
+    if message_type in ("ping", "online_users"):
+        return message_type
+    return None
+
+
+def encode_message(message: dict) -> EncodedMessage:
+    """按消息类型确定事件类别（即发送优先级），在线状态事件附带合并键"""
+    message_type = message.get("type")
+    kind = classify(message_type)
+    key = collapse_key(message) if kind == KIND_PRESENCE else None
+    return EncodedMessage(message, kind, key=key, acked=message_type in ACKED_TYPES)
+
+
+def parse_caps(raw: str | None) -> frozenset[str]:
+    """解析客户端声明的能力列表（逗号分隔），忽略不支持的能力"""
+    if not raw:
+        return frozenset()
+    return frozenset(cap.strip() for cap in raw.split(",")) & SUPPORTED_CAPS
+
+
+class Connection:
+    """带有界发送队列的 WebSocket 连接"""
+
+    def __init__(
+        self,
+        user_id: int,
+        websocket: WebSocket,
+        session_id: str = "",
+        max_queue: int = 256,
+        max_strikes: int = 8,
+        caps: frozenset[str] = frozenset(),
+        batch_window: float = 0.02,
+        batch_max: int = 64,
+        audio_ring: int = 32
+    ):
+        self.user_id = user_id
+        self.websocket = websocket
+        # 设备会话标识（同一用户的多个设备各自一个连接）
+        self.session_id = session_id
+        self.max_queue = max_queue
+        self.max_strikes = max_strikes
+        # 客户端声明的能力
+        self.caps = caps
+        # 帧编码
+        self.codec = get_codec(caps)
+        # 批量推送的合并窗口（秒），未启用批量时为 0
+        self.batch_window = batch_window if CAP_BATCH in caps else 0.0
+        self.batch_max = batch_max
+        # 发送队列，每个类别一道: {类别: 帧队列}，帧为按本连接编码好的事件，
+        # 音频（KIND_AUDIO）为原始音频数据
+        self._lanes: dict[str, deque[str | bytes]] = {kind: deque() for kind in LANES if kind != KIND_PRESENCE}
+        # 音频道为环形缓冲：实时语音宁可丢帧也不要累积延迟
+        self._lanes[KIND_AUDIO] = deque(maxlen=audio_ring)
+        # 在线状态道: {合并键: 帧}（按插入顺序发送），不可合并的事件用递增序号作键
+        self._presence: dict[str | int, str | bytes] = {}
+        self._presence_seq = 0
+        self._wakeup = asyncio.Event()
+        self._writer: asyncio.Task | None = None
+        self._closing: asyncio.Task | None = None
+        self.closed = False
+        # 连续溢出次数（队列清空时归零）
+        self.strikes = 0
+        # 累计丢弃的事件数
+        self.dropped = 0
+        # 最后一次收到客户端数据的时间（time.monotonic）
+        self.last_activity = time.monotonic()
+        # 本设备会话的未确认窗口（由 manager 在建立连接时挂上）
+        self.window: DeliveryWindow | None = None
+        # 重放未确认窗口之前，需要确认的消息只记入窗口、暂不入队（保证按序号顺序发送）
+        self.holding = True
+
+    def start(self):
+        """启动写协程"""
+        self._writer = asyncio.create_task(self._run())
+
+    def touch(self):
+        """记录客户端活跃（每次 receive() 后调用）"""
+        self.last_activity = time.monotonic()
+
+    def enqueue(self, frame: str | bytes, kind: str = KIND_CHAT, key: str | None = None) -> bool:
+        """入队一个待发送的帧，返回是否入队成功（不等待实际发送）
+
+        key: 在线状态事件的合并键，队列中已有相同键的事件时直接替换（不占用新的位置）
+        """
+        if self.closed:
+            return False
+
+        if kind == KIND_PRESENCE and key is not None and key in self._presence:
+            # 旧状态已过时：移除后追加到末尾，保持与其他状态事件的先后顺序
+            del self._presence[key]
+            self._presence[key] = frame
+            self._wakeup.set()
+            return True
+
+        if kind == KIND_AUDIO:
+            lane = self._lanes[KIND_AUDIO]
+            if len(lane) == lane.maxlen:
+                # deque 满时 append 会自动挤掉最旧的一帧
+                self.dropped += 1
+            lane.append(frame)
+            self._wakeup.set()
+            return True
+
+        if self.pending >= self.max_queue and kind != KIND_CALL:
+            if kind in DROPPABLE_KINDS:
+                self.dropped += 1
+                return False
+            if not self._evict_droppable():
+                self.dropped += 1
+                self.strikes += 1
+                logger.warning(
+                    f"用户 {self.user_id} 设备 {self.session_id} 发送队列已满（{self.pending}），"
+                    f"丢弃消息，违规 {self.strikes}/{self.max_strikes}"
+                )
+                if self.strikes >= self.max_strikes:
+                    self._close_later(LAGGARD_CLOSE_CODE, "发送队列积压")
+                return False
+
+        if kind == KIND_PRESENCE:
+            if key is None:
+                self._presence_seq += 1
+                key = self._presence_seq
+            self._presence[key] = frame
+        else:
+            self._lanes[kind].append(frame)
+        self._wakeup.set()
+        return True
+
+    def enqueue_message(self, message: EncodedMessage) -> bool:
+        """按本连接的编码入队一条消息"""
+        if message.requires and message.requires not in self.caps:
+            return any([self.enqueue_message(m) for m in message.fallback])
+        if message.acked and self.window is not None:
+            if self.closed:
+                return False
+            seq = self.window.push(message)
+            if self.holding:
+                return True
+            return self.enqueue(self.codec.with_seq(message.frame(self.codec), seq), message.kind)
+        return self.enqueue(message.frame(self.codec), message.kind, message.key)
+
+    def replay_unacked(self) -> int:
+        """重放未确认窗口（重连后、connected 之后调用），之后的推送直接入队，返回重放条数"""
+        self.holding = False
+        if self.window is None:
+            return 0
+        unacked = self.window.unacked()
+        for seq, message in unacked:
+            self.enqueue(self.codec.with_seq(message.frame(self.codec), seq), message.kind)
+        return len(unacked)
+
+    def send_message(self, message: dict) -> bool:
+        """只发给当前这台设备（回复客户端自己的请求，如 pong、错误提示）"""
+        return self.enqueue_message(encode_message(message))
+
+    def _evict_droppable(self) -> bool:
+        """挤掉队列中最早的一个可丢弃事件（先在线状态，后音频）"""
+        if self._presence:
+            del self._presence[next(iter(self._presence))]
+        elif self._lanes[KIND_AUDIO]:
+            self._lanes[KIND_AUDIO].popleft()
+        else:
+            return False
+        self.dropped += 1
+        return True
+
+    def _top_kind(self) -> str | None:
+        """当前优先级最高的非空道"""
+        for kind in LANES:
+            if (self._presence if kind == KIND_PRESENCE else self._lanes[kind]):
+                return kind
+        return None
+
+    def _pop(self, kind: str) -> str | bytes:
+        if kind == KIND_PRESENCE:
+            return self._presence.pop(next(iter(self._presence)))
+        return self._lanes[kind].popleft()
+
+    @property
+    def pending(self) -> int:
+        """队列中待发送的帧数（所有道合计）"""
+        return len(self._presence) + sum(len(lane) for lane in self._lanes.values())
+
+    async def _run(self):
+        """写协程：总是先发送优先级最高的道里的帧"""
+        try:
+            while True:
+                while not self.pending:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                if self.batch_window:
+                    await self._send_batch()
+                else:
+                    kind = self._top_kind()
+                    await self._send(kind, self._pop(kind))
+                if not self.pending:
+                    self.strikes = 0
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"发送消息给用户 {self.user_id} 失败: {e}")
+            self.closed = True
+            self._clear()
+
+    async def _send_batch(self):
+        """批量模式：等待合并窗口，按优先级取出事件合成一个数组帧"""
+        if self._top_kind() not in URGENT_KINDS:
+            await asyncio.sleep(self.batch_window)
+            if not self.pending:
+                return
+
+        frames = []
+        while len(frames) < self.batch_max:
+            kind = self._top_kind()
+            if kind is None or kind == KIND_AUDIO:
+                break
+            frames.append(self._pop(kind))
+
+        if not frames:
+            await self._send(KIND_AUDIO, self._pop(KIND_AUDIO))
+        elif len(frames) == 1:
+            await self._send(KIND_CHAT, frames[0])
+        else:
+            await self._send_frame(self.codec.batch_frame(frames))
+
+    async def _send(self, kind: str, frame: str | bytes):
+        if kind == KIND_AUDIO:
+            await self._send_frame(self.codec.audio_frame(frame))
+        else:
+            await self._send_frame(self.codec.event_frame(frame))
+
+    async def _send_frame(self, frame: str | bytes):
+        if isinstance(frame, bytes):
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+
+    def _close_later(self, code: int, reason: str):
+        if self._closing is None:
+            self._closing = asyncio.create_task(self.close(code, reason))
+
+    def _clear(self):
+        for lane in self._lanes.values():
+            lane.clear()
+        self._presence.clear()
+
+    def stop(self):
+        """停止写协程（不关闭底层 WebSocket）"""
+        self.closed = True
+        self._clear()
+        if self._writer and not self._writer.done():
+            self._writer.cancel()
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        """停止写协程并关闭 WebSocket"""
+        self.stop()
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception as e:
+            logger.warning(f"关闭用户 {self.user_id} 连接时出错: {e}")
@@ -0,0 +1,128 @@
+"""推送消息的确认（ack）与重传
+
+new_message / new_group_message 推送到每个设备时带上该设备会话内递增的序号 seq：
+    {"seq": 12, "type": "new_message", "data": {...}}
+客户端处理完后发送累计确认（确认该 seq 及之前的所有消息），不必逐条确认：
+    {"type": "ack", "seq": 12}
+
+服务端为每个设备会话（用户 + session_id）保留一个有界的未确认窗口，连接断开后
+再保留 WS_RESUME_TOKEN_TTL 秒。客户端带同一个 session_id（或 resume 令牌）重连时，
+在 /ws?ack= 上带上已处理的最大 seq，服务端在 connected 之后按原序号重发窗口里
+剩下的消息；connected 中的 delivery.acked 为服务端确认到的序号，客户端以此为去重水位。
+
+以下情况 delivery.gap 为 true，客户端需要用同步游标（cursor）或历史记录补齐：
+    - 客户端长时间不确认，窗口溢出，最旧的未确认消息被丢弃
+    - 窗口已过期或重连到了另一个 worker（此时序号从 1 重新开始，acked 为 0）
+
+用户所有设备都离线期间的消息不进入窗口，由同步游标负责。
+"""
+from collections import deque
+from typing import Dict
+from app.websocket.codec import EncodedMessage
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryWindow:
+    """一个设备会话的推送序号和未确认窗口"""
+
+    __slots__ = ("size", "last_seq", "acked", "gap", "_unacked")
+
+    def __init__(self, size: int):
+        self.size = size
+        # 最近分配的序号
+        self.last_seq = 0
+        # 客户端累计确认到的序号
+        self.acked = 0
+        # 窗口溢出后置位，重连时告知客户端
+        self.gap = False
+        # [(序号, 消息)]
+        self._unacked: deque[tuple[int, EncodedMessage]] = deque()
+
+    def __len__(self) -> int:
+        return len(self._unacked)
+
+    def push(self, message: EncodedMessage) -> int:
+        """为一条推送分配序号并放入未确认窗口"""
+        self.last_seq += 1
+        self._unacked.append((self.last_seq, message))
+        if len(self._unacked) > self.size:
+            self._unacked.popleft()
+            self.gap = True
+        return self.last_seq
+
+    def ack(self, seq: int) -> int:
+        """累计确认，返回移出窗口的条数（超出已分配序号的部分忽略）"""
+        seq = min(seq, self.last_seq)
+        removed = 0
+        while self._unacked and self._unacked[0][0] <= seq:
+            self._unacked.popleft()
+            removed += 1
+        self.acked = max(self.acked, seq)
+        return removed
+
+    def resume(self, ack: int | None) -> bool:
+        """重连：应用客户端带来的确认序号，返回是否有消息缺口"""
+        # 客户端确认过的序号比本窗口分配过的还大，说明原窗口已不在
+        gap = self.gap or (ack is not None and ack > self.last_seq)
+        if ack is not None:
+            self.ack(ack)
+        self.gap = False
+        return gap
+
+    def unacked(self) -> list[tuple[int, EncodedMessage]]:
+        return list(self._unacked)
+
+
+class DeliveryTracker:
+    """本 worker 上所有设备会话的未确认窗口"""
+
+    def __init__(self, window_size: int, retain: float):
+        self.window_size = window_size
+        self.retain = retain
+        self._windows: Dict[tuple[int, str], DeliveryWindow] = {}
+        # 已断开、等待过期的窗口: {(用户, 会话): 定时器}
+        self._expiry: Dict[tuple[int, str], asyncio.TimerHandle] = {}
+
+    def attach(self, user_id: int, session_id: str) -> DeliveryWindow:
+        """取出设备会话的窗口（重连时沿用，取消过期），没有则新建"""
+        key = (user_id, session_id)
+        handle = self._expiry.pop(key, None)
+        if handle:
+            handle.cancel()
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = DeliveryWindow(self.window_size)
+        return window
+
+    def detach(self, user_id: int, session_id: str):
+        """设备断开：窗口再保留 retain 秒，等待同一会话重连"""
+        key = (user_id, session_id)
+        if key not in self._windows:
+            return
+        old = self._expiry.pop(key, None)
+        if old:
+            old.cancel()
+        loop = asyncio.get_running_loop()
+        self._expiry[key] = loop.call_later(self.retain, self._expire, key)
+
+    def _expire(self, key: tuple[int, str]):
+        self._expiry.pop(key, None)
+        window = self._windows.pop(key, None)
+        if window is not None and len(window):
+            logger.info(f"用户 {key[0]} 设备 {key[1]} 未在保留期内重连，丢弃 {len(window)} 条未确认消息")
+
+    def stop(self):
+        for handle in self._expiry.values():
+            handle.cancel()
+        self._expiry.clear()
+        self._windows.clear()
+
+    def stats(self) -> dict:
+        return {
+            "windows": len(self._windows),
+            "detached": len(self._expiry),
+            "unacked": sum(len(w) for w in self._windows.values())
+        }
@@ -0,0 +1,135 @@
+"""WebSocket 客户端消息分发
+
+每种消息类型注册一个处理函数，声明参数校验模型和优先级（回复使用的事件类别），
+接收循环解码后按 type 查表分发，不再逐个 if/elif 比较。
+
+    @dispatcher.handler("voice_call_hangup", priority=KIND_CALL)
+    async def _hangup(ctx: HandlerContext, msg: dict): ...
+
+分发器按类型统计调用次数、错误数和处理耗时分布，通过 /api/diagnostics/loop 查看；
+未注册的类型与原来一样直接忽略（只计数，不回复，不记录消息内容）。
+"""
+from bisect import bisect_left
+from typing import Awaitable, Callable, Dict, Type
+from fastapi import WebSocket
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.orm import Session
+from app.core.diagnostics import set_label
+from app.websocket.codec import EncodedMessage
+from app.websocket.connection import Connection, KIND_CHAT
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 耗时分布的桶上限（毫秒），最后一个桶为 +Inf
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class HandlerContext:
+    """处理一条消息所需的连接信息"""
+
+    __slots__ = ("connection", "websocket", "db", "user_id", "session_id", "priority")
+
+    def __init__(self, connection: Connection, websocket: WebSocket, db: Session):
+        self.connection = connection
+        self.websocket = websocket
+        self.db = db
+        self.user_id = connection.user_id
+        self.session_id = connection.session_id
+        # 当前处理函数声明的优先级
+        self.priority = KIND_CHAT
+
+    def reply(self, message: dict) -> bool:
+        """回复当前这台设备，按处理函数声明的优先级入队"""
+        return self.connection.enqueue_message(EncodedMessage(message, self.priority))
+
+
+Handler = Callable[[HandlerContext, object], Awaitable[None]]
+
+
+class _Route:
+    __slots__ = ("handler", "schema", "priority", "count", "errors", "total_ms", "buckets")
+
+    def __init__(self, handler: Handler, schema: Type[BaseModel] | None, priority: str):
+        self.handler = handler
+        self.schema = schema
+        self.priority = priority
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def observe(self, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.buckets[bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+
+    def stats(self) -> dict:
+        return {
+            "priority": self.priority,
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "histogram_ms": {
+                **{f"le_{le}": n for le, n in zip(LATENCY_BUCKETS_MS, self.buckets)},
+                "le_inf": self.buckets[-1]
+            }
+        }
+
+
+class Dispatcher:
+    """按消息 type 查表分发"""
+
+    def __init__(self):
+        self._routes: Dict[str, _Route] = {}
+        self.unknown = 0
+        self.invalid = 0
+
+    def handler(self, message_type: str, schema: Type[BaseModel] | None = None, priority: str = KIND_CHAT):
+        """注册处理函数；有 schema 时处理函数收到校验后的模型，否则收到原始 dict"""
+        def decorator(func: Handler) -> Handler:
+            self._routes[message_type] = _Route(func, schema, priority)
+            return func
+        return decorator
+
+    async def dispatch(self, ctx: HandlerContext, message: dict):
+        message_type = message.get("type")
+        route = self._routes.get(message_type) if isinstance(message_type, str) else None
+        if route is None:
+            self.unknown += 1
+            logger.debug(f"用户 {ctx.user_id} 发送了未知消息类型")
+            return
+
+        set_label(f"ws:{message_type}")
+        ctx.priority = route.priority
+        started = time.perf_counter()
+        try:
+            if route.schema is not None:
+                payload = route.schema.model_validate(message)
+            else:
+                payload = message
+            await route.handler(ctx, payload)
+        except ValidationError as e:
+            route.errors += 1
+            self.invalid += 1
+            ctx.reply({
+                "type": "error",
+                "data": {"reason": "参数错误", "message_type": message_type, "errors": e.error_count()}
+            })
+        except Exception as e:
+            route.errors += 1
+            logger.error(f"处理用户 {ctx.user_id} 的 {message_type} 消息失败: {e}")
+        finally:
+            route.observe((time.perf_counter() - started) * 1000)
+
+    def stats(self) -> dict:
+        return {
+            "unknown": self.unknown,
+            "invalid": self.invalid,
+            "types": {t: route.stats() for t, route in self._routes.items()}
+        }
+
+
+# 全局单例（处理函数见 handlers.py）
+dispatcher = Dispatcher()
@@ -0,0 +1,201 @@
+"""客户端通过 /ws 发来的消息的处理函数
+
+每个处理函数用 @dispatcher.handler 注册，声明消息类型、参数模型和优先级，
+由接收循环通过 dispatcher.dispatch() 调用，见 dispatcher.py。
+"""
+from typing import Any, Optional
+from pydantic import BaseModel, Field
+from app.websocket.connection import KIND_CALL, KIND_CHAT, KIND_PRESENCE
+from app.websocket.dispatcher import dispatcher, HandlerContext
+from app.websocket.manager import manager
+from app.websocket.rpc import handle_rpc
+
+
+# ==================== 参数 ====================
+
+class Ping(BaseModel):
+    # 原样带回，不限制格式
+    timestamp: Any = None
+
+
+class Ack(BaseModel):
+    seq: int = Field(ge=0)
+
+
+class VoiceCallRequest(BaseModel):
+    to_user_id: int
+    caller_name: Optional[str] = None
+    caller_avatar: Optional[str] = None
+
+
+class VoiceCallAccept(BaseModel):
+    caller_id: int
+    receiver_name: Optional[str] = None
+    receiver_avatar: Optional[str] = None
+
+
+class VoiceCallReject(BaseModel):
+    caller_id: int
+
+
+class VoiceCallCancel(BaseModel):
+    receiver_id: Optional[int] = None
+
+
+# ==================== 心跳 ====================
+
+@dispatcher.handler("ping", Ping, priority=KIND_PRESENCE)
+async def _ping(ctx: HandlerContext, msg: Ping):
+    ctx.reply({
+        "type": "pong",
+        "data": {"timestamp": msg.timestamp}
+    })
+
+
+@dispatcher.handler("ack", Ack, priority=KIND_PRESENCE)
+async def _ack(ctx: HandlerContext, msg: Ack):
+    """累计确认推送，见 delivery.py"""
+    if ctx.connection.window is not None:
+        ctx.connection.window.ack(msg.seq)
+
+
+# ==================== 请求 / 响应 ====================
+
+@dispatcher.handler("rpc", priority=KIND_CHAT)
+async def _rpc(ctx: HandlerContext, msg: dict):
+    """发消息、拉历史、标记已读、未读数，见 rpc.py"""
+    await handle_rpc(ctx.db, ctx.connection, msg)
+
+
+# ==================== 语音通话信令 ====================
+
+@dispatcher.handler("voice_call_request", VoiceCallRequest, priority=KIND_CALL)
+async def _voice_call_request(ctx: HandlerContext, msg: VoiceCallRequest):
+    receiver_id = msg.to_user_id
+
+    # 检查对方是否在线
+    if not manager.is_online(receiver_id):
+        ctx.reply({
+            "type": "voice_call_failed",
+            "data": {"reason": "对方不在线"}
+        })
+        return
+
+    # 检查自己是否正在通话
+    if manager.is_in_call(ctx.user_id):
+        ctx.reply({
+            "type": "voice_call_failed",
+            "data": {"reason": "您正在通话中"}
+        })
+        return
+
+    # 检查对方是否正在通话
+    if manager.is_in_call(receiver_id):
+        ctx.reply({
+            "type": "voice_call_busy",
+            "data": {"reason": "对方正在通话中"}
+        })
+        return
+
+    # 记录发起通话的设备和呼叫对象，转发通话请求给对方的所有设备
+    manager.ring(ctx.user_id, receiver_id, ctx.session_id)
+    await manager.send_personal_message(receiver_id, {
+        "type": "voice_call_incoming",
+        "data": {
+            "caller_id": ctx.user_id,
+            "caller_name": msg.caller_name,
+            "caller_avatar": msg.caller_avatar
+        }
+    })
+
+
+@dispatcher.handler("voice_call_accept", VoiceCallAccept, priority=KIND_CALL)
+async def _voice_call_accept(ctx: HandlerContext, msg: VoiceCallAccept):
+    caller_id = msg.caller_id
+
+    # 检查发起方是否正在呼叫自己（可能已取消）
+    if manager.get_pending_call(caller_id) != ctx.user_id:
+        ctx.reply({
+            "type": "voice_call_failed",
+            "data": {"reason": "通话已取消"}
+        })
+        return
+
+    # 检查发起方是否还在线
+    if not manager.is_online(caller_id):
+        ctx.reply({
+            "type": "voice_call_failed",
+            "data": {"reason": "对方已离线"}
+        })
+        return
+
+    # 检查发起方是否已经在通话中（可能接了其他人的电话）
+    if manager.is_in_call(caller_id):
+        ctx.reply({
+            "type": "voice_call_failed",
+            "data": {"reason": "对方已在通话中"}
+        })
+        return
+
+    # 建立通话映射
+    manager.start_call(caller_id, ctx.user_id, ctx.session_id)
+
+    # 通知发起方通话已接通
+    await manager.send_personal_message(caller_id, {
+        "type": "voice_call_connected",
+        "data": {
+            "peer_id": ctx.user_id,
+            "peer_name": msg.receiver_name,
+            "peer_avatar": msg.receiver_avatar
+        }
+    })
+
+    # 通知接收方（接听的这台设备）通话已接通
+    ctx.reply({
+        "type": "voice_call_connected",
+        "data": {"peer_id": caller_id}
+    })
+
+    # 通知接收方的其他设备停止响铃
+    await manager.send_personal_message(ctx.user_id, {
+        "type": "voice_call_answered_elsewhere",
+        "data": {"caller_id": caller_id}
+    }, exclude_session=ctx.session_id)
+
+
+@dispatcher.handler("voice_call_reject", VoiceCallReject, priority=KIND_CALL)
+async def _voice_call_reject(ctx: HandlerContext, msg: VoiceCallReject):
+    # 只处理对方正在呼叫自己的通话，不能替别人清除通话状态
+    if manager.get_pending_call(msg.caller_id) != ctx.user_id:
+        return
+    manager.clear_call_session(msg.caller_id)
+    # 通知发起方被拒绝
+    await manager.send_personal_message(msg.caller_id, {
+        "type": "voice_call_rejected",
+        "data": {"reason": "对方拒绝了通话"}
+    })
+
+
+@dispatcher.handler("voice_call_cancel", VoiceCallCancel, priority=KIND_CALL)
+async def _voice_call_cancel(ctx: HandlerContext, msg: VoiceCallCancel):
+    """呼叫中主动挂断（包括客户端呼叫超时），通知接收方通话已取消"""
+    receiver_id = manager.get_pending_call(ctx.user_id)
+    if receiver_id is None or (msg.receiver_id and msg.receiver_id != receiver_id):
+        return
+    manager.clear_call_session(ctx.user_id)
+    if receiver_id:
+        await manager.send_personal_message(receiver_id, {
+            "type": "voice_call_cancelled",
+            "data": {"reason": "对方已取消通话"}
+        })
+
+
+@dispatcher.handler("voice_call_hangup", priority=KIND_CALL)
+async def _voice_call_hangup(ctx: HandlerContext, msg: dict):
+    peer_id = manager.end_call(ctx.user_id)
+    if peer_id:
+        # 通知对方通话已结束
+        await manager.send_personal_message(peer_id, {
+            "type": "voice_call_ended",
+            "data": {"reason": "对方已挂断"}
+        })
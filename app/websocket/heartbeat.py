@@ -0,0 +1,109 @@
+"""时间轮心跳与失效连接回收
+
+把一个心跳周期切成若干槽，每个连接挂在“下一次需要检查”的那个槽上，
+每个 tick 只处理当前槽里的连接：
+    - 空闲超过 idle_timeout: 视为失效，回收连接
+    - 空闲超过 interval: 入队一个 ping，一个周期后再检查
+    - 否则按最后活跃时间推算截止时间，挂到对应的槽上
+连接的最后活跃时间由接收循环在每次 receive() 后更新（只改时间戳，不动时间轮）。
+时间轮以连接为单位，同一用户的多个设备各自独立检查和回收。
+新连接按 user_id 打散到不同的槽，ping 均匀分布在整个周期内；
+每个 tick 的开销只和到期的连接数有关，与总连接数无关。
+"""
+from typing import Dict, TYPE_CHECKING
+import asyncio
+import logging
+import math
+import time
+
+from app.websocket.codec import EncodedMessage
+from app.websocket.connection import Connection, KIND_PRESENCE
+
+if TYPE_CHECKING:
+    from app.websocket.manager import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+# 回收空闲连接使用的关闭码（1001: Going Away）
+IDLE_CLOSE_CODE = 1001
+
+
+class HeartbeatWheel:
+    """时间轮心跳"""
+
+    def __init__(self, manager: "ConnectionManager", interval: float, idle_timeout: float, slots: int):
+        self.manager = manager
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.tick = interval / slots
+        self._slots: list[set[Connection]] = [set() for _ in range(slots)]
+        # {连接: 所在槽位}
+        self._slot_of: Dict[Connection, int] = {}
+        self._cursor = 0
+        self._task: asyncio.Task | None = None
+        self._closing: set[asyncio.Task] = set()
+        self._ping = EncodedMessage({"type": "ping"}, KIND_PRESENCE, key="ping")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def add(self, connection: Connection):
+        """新连接：按 user_id 打散到一个周期内的某个槽"""
+        self._place(connection, connection.user_id % len(self._slots) + 1)
+
+    def remove(self, connection: Connection):
+        slot = self._slot_of.pop(connection, None)
+        if slot is not None:
+            self._slots[slot].discard(connection)
+
+    def _place(self, connection: Connection, ticks_ahead: int):
+        self.remove(connection)
+        ticks_ahead = min(max(ticks_ahead, 1), len(self._slots) - 1)
+        slot = (self._cursor + ticks_ahead) % len(self._slots)
+        self._slots[slot].add(connection)
+        self._slot_of[connection] = slot
+
+    def _ticks_until(self, seconds: float) -> int:
+        return math.ceil(seconds / self.tick)
+
+    async def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.tick
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            due = self._slots[self._cursor]
+            if due:
+                self._slots[self._cursor] = set()
+                self._process(due)
+
+    def _process(self, due: set[Connection]):
+        now = time.monotonic()
+        for connection in due:
+            self._slot_of.pop(connection, None)
+
+            idle = now - connection.last_activity
+            if connection.closed or idle >= self.idle_timeout:
+                self._reap(connection)
+            elif idle >= self.interval:
+                connection.enqueue_message(self._ping)
+                self._place(connection, self._ticks_until(min(self.interval, self.idle_timeout - idle)))
+            else:
+                self._place(connection, self._ticks_until(self.interval - idle))
+
+    def _reap(self, connection: Connection):
+        """回收失效连接：从在线列表移除（同接收循环退出时的清理，包括挂断通话），再关闭底层 WebSocket"""
+        logger.info(f"回收失效连接: 用户 {connection.user_id} 设备 {connection.session_id}")
+        task = asyncio.create_task(self._release(connection))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _release(self, connection: Connection):
+        try:
+            await self.manager.release(connection)
+        finally:
+            await connection.close(IDLE_CLOSE_CODE, "心跳超时")
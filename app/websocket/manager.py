@@ -1,8 +1,17 @@
-from typing import Dict
+from typing import Dict, Iterable
 from fastapi import WebSocket
-import json
+from app.core.config import settings
+from app.websocket.bus import MessageBus, create_bus, PEER_JOINED, PEER_LOST
+from app.websocket.connection import Connection, encode_message, KIND_AUDIO
+from app.websocket.codec import EncodedMessage
+from app.websocket.presence import PresenceEngine
+from app.websocket.relay import CallRelay
+from app.websocket.heartbeat import HeartbeatWheel
+from app.websocket.delivery import DeliveryTracker
 import logging
 import asyncio
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
@@ -10,54 +19,251 @@ logger = logging.getLogger(__name__)
 class ConnectionManager:
     """WebSocket连接管理器"""
     
-    def __init__(self):
-        # 存储活跃连接: {user_id: WebSocket}
-        self.active_connections: Dict[int, WebSocket] = {}
+    def __init__(self, bus: MessageBus | None = None):
+        # 存储活跃连接（一个用户可以有多个设备同时在线）: {user_id: {session_id: Connection}}
+        self.active_connections: Dict[int, Dict[str, Connection]] = {}
         # 存储通话状态: {user_id: peer_user_id}
         self.active_calls: Dict[int, int] = {}
+        # 用户参与通话的设备（各 worker 之间同步）: {user_id: session_id}
+        self.call_sessions: Dict[int, str] = {}
+        # 呼叫中、对方尚未接听的通话（各 worker 之间同步）: {caller_id: receiver_id}
+        self.pending_calls: Dict[int, int] = {}
+        # 通话音频转发: {user_id: CallRelay}（通话双方指向同一个 relay）
+        self.call_relays: Dict[int, CallRelay] = {}
+        # 连接在其他 worker 上的用户: {user_id: {worker_id}}
+        self.remote_users: Dict[int, set[str]] = {}
+        # 跨 worker 消息总线
+        self.bus = bus or create_bus(settings.WS_BUS_BACKEND, settings.WS_BUS_DIR)
+        # 后台发布任务（保持引用，防止被回收）
+        self._background: set[asyncio.Task] = set()
+        # 在线状态防抖 / 合并推送
+        self.presence = PresenceEngine(
+            self,
+            grace=settings.PRESENCE_GRACE_SECONDS,
+            batch_window=settings.PRESENCE_BATCH_MS / 1000
+        )
+        # 时间轮心跳 / 失效连接回收
+        self.heartbeat = HeartbeatWheel(
+            self,
+            interval=settings.WS_HEARTBEAT_INTERVAL,
+            idle_timeout=settings.WS_IDLE_TIMEOUT,
+            slots=settings.WS_HEARTBEAT_SLOTS
+        )
+        # 各设备会话的推送序号和未确认窗口
+        self.delivery = DeliveryTracker(
+            window_size=settings.WS_ACK_WINDOW,
+            retain=settings.WS_RESUME_TOKEN_TTL
+        )
+        # 事件循环（供线程池中的同步代码发布总线事件）
+        self._loop: asyncio.AbstractEventLoop | None = None
+        
+        self.bus.subscribe("deliver", self._on_deliver)
+        self.bus.subscribe("deliver_bytes", self._on_deliver_bytes)
+        self.bus.subscribe("presence", self._on_presence)
+        self.bus.subscribe("presence_sync", self._on_presence_sync)
+        self.bus.subscribe("call", self._on_call)
+        self.bus.subscribe("call_session", self._on_call_session)
+        self.bus.subscribe(PEER_JOINED, self._on_peer_joined)
+        self.bus.subscribe(PEER_LOST, self._on_peer_lost)
+    
+    async def start(self):
+        """启动消息总线（在应用 lifespan 中调用）"""
+        self._loop = asyncio.get_running_loop()
+        await self.bus.start()
+        self.heartbeat.start()
     
-    async def connect(self, user_id: int, websocket: WebSocket):
-        """建立连接"""
-        # 如果用户已有连接，先关闭旧连接
-        if user_id in self.active_connections:
-            await self.close_connection(user_id)
+    async def stop(self):
+        """关闭消息总线"""
+        self.heartbeat.stop()
+        self.presence.stop()
+        self.delivery.stop()
+        await self.bus.stop()
+    
+    async def connect(
+        self,
+        user_id: int,
+        websocket: WebSocket,
+        session_id: str | None = None,
+        caps: frozenset[str] = frozenset()
+    ) -> Connection:
+        """建立连接
+        
+        同一用户的不同设备（session_id 不同）可以同时在线；
+        同一个 session_id 重连时关闭旧连接，沿用其未确认窗口
+        （调用方发送 connected 之后需调用 connection.replay_unacked()）。
+        caps 为客户端在握手时声明的能力（如 batch: 批量推送）。
+        """
+        session_id = session_id or uuid.uuid4().hex
+        sessions = self.active_connections.setdefault(user_id, {})
+        old = sessions.pop(session_id, None)
+        if old:
+            self.heartbeat.remove(old)
+            await old.close()
         
         await websocket.accept()
-        self.active_connections[user_id] = websocket
-        logger.info(f"用户 {user_id} 已连接，当前在线: {len(self.active_connections)}")
-    
-    async def close_connection(self, user_id: int):
-        """安全关闭连接"""
-        if user_id in self.active_connections:
-            try:
-                websocket = self.active_connections[user_id]
-                await websocket.close()
-            except Exception as e:
-                logger.warning(f"关闭用户 {user_id} 连接时出错: {e}")
-            finally:
-                del self.active_connections[user_id]
-    
-    def disconnect(self, user_id: int):
-        """断开连接（同步版本）"""
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-            logger.info(f"用户 {user_id} 已断开，当前在线: {len(self.active_connections)}")
-    
-    async def send_personal_message(self, user_id: int, message: dict):
-        """发送消息给指定用户"""
-        if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_text(json.dumps(message, ensure_ascii=False))
-                return True
-            except Exception as e:
-                logger.error(f"发送消息给用户 {user_id} 失败: {e}")
-                self.disconnect(user_id)
-                return False
-        return False
+        connection = Connection(
+            user_id,
+            websocket,
+            session_id=session_id,
+            max_queue=settings.WS_SEND_QUEUE_SIZE,
+            max_strikes=settings.WS_LAGGARD_STRIKES,
+            caps=caps,
+            batch_window=settings.WS_BATCH_WINDOW_MS / 1000,
+            batch_max=settings.WS_BATCH_MAX_EVENTS,
+            audio_ring=settings.WS_AUDIO_RING_SIZE
+        )
+        connection.window = self.delivery.attach(user_id, session_id)
+        connection.start()
+        first = not sessions
+        sessions[session_id] = connection
+        self.heartbeat.add(connection)
+        if first:
+            await self.bus.publish("presence", {"user_id": user_id, "online": True})
+        logger.info(
+            f"用户 {user_id} 设备 {session_id} 已连接，该用户设备数: {len(sessions)}，"
+            f"当前在线: {len(self.active_connections)}"
+        )
+        return connection
+    
+    def disconnect(self, connection: Connection) -> bool:
+        """断开连接（同步版本），返回该用户在本 worker 上是否已没有其他设备在线"""
+        sessions = self.active_connections.get(connection.user_id)
+        if not sessions or sessions.get(connection.session_id) is not connection:
+            # 已被同 session 的新连接替换，或已被移除
+            connection.stop()
+            return False
+        
+        del sessions[connection.session_id]
+        connection.stop()
+        self.heartbeat.remove(connection)
+        self.delivery.detach(connection.user_id, connection.session_id)
+        if sessions:
+            return False
+        
+        del self.active_connections[connection.user_id]
+        self.publish_event("presence", {"user_id": connection.user_id, "online": False})
+        logger.info(f"用户 {connection.user_id} 已断开，当前在线: {len(self.active_connections)}")
+        return True
+    
+    async def release(self, connection: Connection):
+        """连接结束后的清理（接收循环退出、心跳回收都会调用，重复调用只生效一次）
+        
+        - 通话所在的设备断开（或用户已没有任何设备在线），通知对方挂断
+        - 最后一台设备断开：宽限期后仍未重连再广播下线状态给其联系人
+        """
+        sessions = self.active_connections.get(connection.user_id)
+        if not sessions or sessions.get(connection.session_id) is not connection:
+            # 已被回收，或已被同 session 的新连接替换
+            connection.stop()
+            return
+        
+        user_id = connection.user_id
+        last_session = self.disconnect(connection)
+        call_session = self.get_call_session(user_id)
+        if call_session == connection.session_id or (call_session is None and last_session):
+            peer_id = self.end_call(user_id)
+            if peer_id:
+                await self.send_personal_message(peer_id, {
+                    "type": "voice_call_ended",
+                    "data": {"reason": "对方已断开连接"}
+                })
+        if last_session:
+            self.presence.user_disconnected(user_id)
+    
+    def _enqueue_local(self, user_id: int, message: EncodedMessage, exclude_session: str | None = None) -> bool:
+        """放入用户在本 worker 上所有设备的发送队列，任一成功即返回 True"""
+        ok = False
+        for session_id, connection in self.active_connections.get(user_id, {}).items():
+            if session_id != exclude_session and connection.enqueue_message(message):
+                ok = True
+        return ok
+    
+    async def send_personal_message(self, user_id: int, message: dict, exclude_session: str | None = None):
+        """发送消息给指定用户的所有设备（其他 worker 上的设备经总线转发）
+        
+        只负责放入各连接的发送队列，不等待实际发送完成
+        """
+        if not self.is_online(user_id):
+            return False
+        encoded = encode_message(message)
+        ok = self._enqueue_local(user_id, encoded, exclude_session)
+        for worker_id in self.remote_users.get(user_id, ()):
+            if await self.bus.send_to(
+                worker_id,
+                "deliver",
+                {
+                    "user_ids": [user_id],
+                    "frame": encoded.json,
+                    "kind": encoded.kind,
+                    "key": encoded.key,
+                    "acked": encoded.acked,
+                    "exclude_session": exclude_session
+                }
+            ):
+                ok = True
+        return ok
+    
+    async def fanout(self, user_ids: Iterable[int], message: dict | EncodedMessage) -> dict:
+        """把同一条消息推送给多个用户（message 可以是已构造好的 EncodedMessage）
+        
+        消息每种编码只编码一次；本 worker 上的连接分块入队（块之间让出事件循环），
+        其他 worker 上的用户按 worker 合并成一次总线投递并发发送。
+        
+        Returns:
+            {"delivered": 入队成功数, "failed": 入队失败数, "offline": 不在线数, "elapsed_ms": 耗时}
+        """
+        started = time.perf_counter()
+        encoded = message if isinstance(message, EncodedMessage) else encode_message(message)
+        chunk_size = settings.WS_FANOUT_CHUNK_SIZE
+        
+        delivered = failed = offline = 0
+        remote: Dict[str, list[int]] = {}
+        for i, user_id in enumerate(user_ids, 1):
+            workers = self.remote_users.get(user_id, ())
+            if user_id in self.active_connections:
+                if self._enqueue_local(user_id, encoded):
+                    delivered += 1
+                else:
+                    failed += 1
+            elif not workers:
+                offline += 1
+            for worker_id in workers:
+                remote.setdefault(worker_id, []).append(user_id)
+            if i % chunk_size == 0:
+                await asyncio.sleep(0)
+        
+        if remote:
+            workers = list(remote)
+            results = await asyncio.gather(*(
+                self.bus.send_to(wid, "deliver", {
+                    "user_ids": remote[wid],
+                    "frame": encoded.json,
+                    "kind": encoded.kind,
+                    "key": encoded.key,
+                    "acked": encoded.acked,
+                    "requires": encoded.requires,
+                    "fallback": [m.message for m in encoded.fallback]
+                })
+                for wid in workers
+            ))
+            # 本 worker 已有连接的用户不再按远程投递重复计数
+            for wid, ok in zip(workers, results):
+                remote_only = sum(1 for uid in remote[wid] if uid not in self.active_connections)
+                if ok:
+                    delivered += remote_only
+                else:
+                    failed += remote_only
+        
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        logger.debug(
+            f"扇出 {encoded.message.get('type')}: 成功 {delivered}，失败 {failed}，"
+            f"离线 {offline}，耗时 {elapsed_ms}ms"
+        )
+        return {"delivered": delivered, "failed": failed, "offline": offline, "elapsed_ms": elapsed_ms}
     
     def is_online(self, user_id: int) -> bool:
-        """检查用户是否在线"""
-        return user_id in self.active_connections
+        """检查用户是否在线（任意 worker）"""
+        return user_id in self.active_connections or user_id in self.remote_users
     
 # --------------------------------------------------
 # 获取用户的在线联系人列表(新增)
@@ -72,128 +278,262 @@ class ConnectionManager:
         Returns:
             在线联系人的 user_id 列表
         """
-        from app.models.contact import Contact
+        from app.services.contact_service import get_contact_ids_async
         
-        # 获取该用户的所有联系人
-        contacts = db.query(Contact).filter(
-            (Contact.user_id == user_id) | (Contact.contact_user_id == user_id)
-        ).all()
-        
-        # 收集所有联系人的 user_id
-        contact_ids = set()
-        for contact in contacts:
-            if contact.user_id == user_id:
-                contact_ids.add(contact.contact_user_id)
-            else:
-                contact_ids.add(contact.user_id)
+        # 获取该用户的所有联系人（走联系人缓存）
+        contact_ids = await get_contact_ids_async(db, user_id)
         
         # 筛选出在线的联系人
-        online_contacts = [cid for cid in contact_ids if cid in self.active_connections]
+        online_contacts = [cid for cid in contact_ids if self.is_online(cid)]
         return online_contacts
     
     async def broadcast_to_contacts(self, user_id: int, message: dict, db):
         """向用户的所有联系人广播消息"""
-        from app.models.contact import Contact
-        
-        # 获取该用户的所有联系人
-        contacts = db.query(Contact).filter(
-            (Contact.user_id == user_id) | (Contact.contact_user_id == user_id)
-        ).all()
+        from app.services.contact_service import get_contact_ids_async
         
-        # 收集所有联系人的 user_id
-        contact_ids = set()
-        for contact in contacts:
-            if contact.user_id == user_id:
-                contact_ids.add(contact.contact_user_id)
-            else:
-                contact_ids.add(contact.user_id)
+        # 获取该用户的所有联系人（走联系人缓存）
+        contact_ids = await get_contact_ids_async(db, user_id)
         
         # 向在线的联系人发送消息
-        for contact_id in contact_ids:
-            if contact_id in self.active_connections:
-                await self.send_personal_message(contact_id, message)
+        await self.fanout(contact_ids, message)
     
     async def broadcast_user_status(self, user_id: int, status: str, db):
-        """广播用户在线状态给其联系人，并更新数据库
+        """广播用户在线状态给其联系人，并更新实时状态
         
         Args:
             user_id: 用户ID
             status: 'online' 或 'offline'
             db: 数据库会话
         """
-        from app.models.user import User
-        from datetime import datetime, timedelta
-        
-        # 更新数据库中的用户状态
-        user = db.query(User).filter(User.id == user_id).first()
-        if user:
-            user.status = status
-            if status == "offline":
-                user.last_seen = datetime.utcnow() + timedelta(hours=8)
-            else:
-                user.last_seen = None
-            db.commit()
-            logger.info(f"用户 {user_id} 状态已更新为 {status}")
-        
-        # 广播状态变化给联系人
-        message = {
-            "type": f"user_{status}",
-            "data": {"user_id": user_id}
-        }
-        await self.broadcast_to_contacts(user_id, message, db)
-    
-    async def cleanup_stale_connections(self):
-        """清理失效的连接"""
-        stale_users = []
-        for user_id, websocket in self.active_connections.items():
-            try:
-                # 尝试发送 ping 检测连接状态
-                await asyncio.wait_for(
-                    websocket.send_text(json.dumps({"type": "ping"})),
-                    timeout=1.0
-                )
-            except Exception:
-                stale_users.append(user_id)
-        
-        for user_id in stale_users:
-            self.disconnect(user_id)
-            logger.info(f"清理失效连接: 用户 {user_id}")
+        from app.services.presence_store import presence_store
+        
+        # 更新实时状态（由 presence_store 批量回写数据库）
+        presence_store.set_status(user_id, status)
+        logger.info(f"用户 {user_id} 状态已更新为 {status}")
+        
+        # 广播状态变化给在线联系人（由在线状态引擎合并后发送）
+        from app.services.contact_service import get_contact_ids_async
+        
+        contact_ids = await get_contact_ids_async(db, user_id)
+        self.presence.notify(user_id, status, [cid for cid in contact_ids if self.is_online(cid)])
     
     # ========== 语音通话相关方法 ==========
     
-    async def send_binary_message(self, user_id: int, data: bytes):
-        """发送二进制消息给指定用户（用于音频流）"""
-        if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_bytes(data)
-                return True
-            except Exception as e:
-                logger.error(f"发送二进制消息给用户 {user_id} 失败: {e}")
+    def _call_connections(self, user_id: int) -> list[Connection]:
+        """用户在本 worker 上接收通话音频的连接（通话设备在其他 worker 上时为空）"""
+        sessions = self.active_connections.get(user_id, {})
+        call_session = self.call_sessions.get(user_id)
+        if call_session is None:
+            return list(sessions.values())
+        connection = sessions.get(call_session)
+        return [connection] if connection else []
+    
+    async def _send_bytes_remote(self, user_id: int, data: bytes) -> bool:
+        """经总线把二进制帧发给用户所在的其他 worker，由对端挑选通话设备"""
+        ok = False
+        for worker_id in self.remote_users.get(user_id, ()):
+            if await self.bus.send_to(worker_id, "deliver_bytes", {"user_id": user_id}, data):
+                ok = True
+        return ok
+    
+    def relay_audio(self, user_id: int, frame: bytes, session_id: str | None = None) -> bool:
+        """把 user_id 发来的音频帧交给通话转发器（同步，不等待发送）
+        
+        只接受参与通话的那台设备发来的音频，其他设备发来的直接忽略
+        """
+        call_session = self.call_sessions.get(user_id)
+        if session_id and call_session and session_id != call_session:
+            return False
+        relay = self.call_relays.get(user_id)
+        if relay is None:
+            peer_id = self.active_calls.get(user_id)
+            if not peer_id:
                 return False
-        return False
+            relay = CallRelay(user_id, peer_id, self._forward_audio, settings.WS_AUDIO_RING_SIZE)
+            relay.start()
+            self.call_relays[user_id] = relay
+            self.call_relays[peer_id] = relay
+        return relay.push(user_id, frame)
+    
+    async def _forward_audio(self, user_id: int, frame: bytes) -> bool:
+        """转发器的发送函数：本 worker 上放入连接的音频道（由写协程发送），其他 worker 经总线转发"""
+        connections = self._call_connections(user_id)
+        if connections:
+            return any([c.enqueue(frame, KIND_AUDIO) for c in connections])
+        return await self._send_bytes_remote(user_id, frame)
+    
+    def _stop_relay(self, user_id: int, peer_id: int):
+        relay = self.call_relays.pop(user_id, None)
+        self.call_relays.pop(peer_id, None)
+        self.call_sessions.pop(user_id, None)
+        self.call_sessions.pop(peer_id, None)
+        if relay:
+            relay.stop()
+            logger.info(f"通话 {user_id} <-> {peer_id} 音频统计: {relay.stats()}")
+    
+    def get_relay_stats(self) -> dict:
+        """所有进行中通话的音频帧计数: {user_id: {...}}"""
+        stats = {}
+        for relay in set(self.call_relays.values()):
+            stats.update(relay.stats())
+        return stats
     
     def is_in_call(self, user_id: int) -> bool:
         """检查用户是否正在通话中"""
         return user_id in self.active_calls
     
-    def start_call(self, caller_id: int, receiver_id: int):
+    def ring(self, caller_id: int, receiver_id: int, session_id: str):
+        """发起呼叫：记录发起方的设备和呼叫对象，直到接听 / 拒绝 / 取消"""
+        self.call_sessions[caller_id] = session_id
+        self.pending_calls[caller_id] = receiver_id
+        self.publish_event("call_session", {
+            "user_id": caller_id,
+            "session_id": session_id,
+            "receiver_id": receiver_id
+        })
+    
+    def get_pending_call(self, caller_id: int) -> int | None:
+        """caller_id 正在呼叫（对方尚未接听）的用户"""
+        return self.pending_calls.get(caller_id)
+    
+    def clear_call_session(self, user_id: int):
+        """呼叫被拒绝 / 取消：清除发起呼叫时记录的设备和呼叫对象（已接通的通话由 end_call 清除）"""
+        if user_id in self.active_calls:
+            return
+        receiver_id = self.pending_calls.pop(user_id, None)
+        session_id = self.call_sessions.pop(user_id, None)
+        if receiver_id is not None or session_id is not None:
+            self.publish_event("call_session", {"user_id": user_id, "session_id": None})
+    
+    def get_call_session(self, user_id: int) -> str | None:
+        """获取用户参与通话的设备"""
+        return self.call_sessions.get(user_id)
+    
+    def start_call(self, caller_id: int, receiver_id: int, receiver_session: str | None = None):
         """建立通话映射"""
         self.active_calls[caller_id] = receiver_id
         self.active_calls[receiver_id] = caller_id
+        self.pending_calls.pop(caller_id, None)
+        if receiver_session:
+            self.call_sessions[receiver_id] = receiver_session
+        self.publish_event("call", {
+            "user_id": caller_id,
+            "peer_id": receiver_id,
+            "session_id": receiver_session
+        })
         logger.info(f"通话建立: {caller_id} <-> {receiver_id}")
     
     def end_call(self, user_id: int) -> int | None:
-        """结束通话，返回对方的 user_id"""
+        """结束通话，返回对方的 user_id（还在呼叫中时只清除呼叫，返回 None）"""
         peer_id = self.active_calls.get(user_id)
-        if peer_id:
-            self.active_calls.pop(user_id, None)
-            self.active_calls.pop(peer_id, None)
-            logger.info(f"通话结束: {user_id} <-> {peer_id}")
+        if not peer_id:
+            self.clear_call_session(user_id)
+            return None
+        self.call_sessions.pop(user_id, None)
+        self.active_calls.pop(user_id, None)
+        self.active_calls.pop(peer_id, None)
+        self._stop_relay(user_id, peer_id)
+        self.publish_event("call", {"user_id": user_id, "peer_id": None})
+        logger.info(f"通话结束: {user_id} <-> {peer_id}")
         return peer_id
     
-    def get_call_peer(self, user_id: int) -> int | None:
-        """获取通话对方的 user_id"""
-        return self.active_calls.get(user_id)
+    # ========== 跨 worker 总线 ==========
+    
+    def publish_event(self, topic: str, payload: dict):
+        """发布总线事件给其他 worker，不等待完成
+        
+        可以在事件循环中调用，也可以在线程池里的同步接口中调用
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        
+        if running is not None:
+            task = running.create_task(self.bus.publish(topic, payload))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        elif self._loop is not None and not self._loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self.bus.publish(topic, payload), self._loop)
+    
+    async def _on_deliver(self, source: str, payload: dict, body: bytes | None):
+        """其他 worker 转发来的文本消息（已编码好的帧）"""
+        encoded = EncodedMessage.from_json(
+            payload["frame"], payload["kind"], payload.get("key"), payload.get("acked", False)
+        )
+        if payload.get("requires"):
+            encoded.requires = payload["requires"]
+            encoded.fallback = [encode_message(m) for m in payload.get("fallback", [])]
+        for user_id in payload["user_ids"]:
+            self._enqueue_local(user_id, encoded, payload.get("exclude_session"))
+    
+    async def _on_deliver_bytes(self, source: str, payload: dict, body: bytes | None):
+        """其他 worker 转发来的二进制消息（通话音频）"""
+        user_id = payload["user_id"]
+        if body:
+            # 只投递给本 worker 上的设备，不再转发，避免在 worker 之间来回传递
+            for connection in self._call_connections(user_id):
+                connection.enqueue(body, KIND_AUDIO)
+    
+    async def _on_presence(self, source: str, payload: dict, body: bytes | None):
+        """其他 worker 上的用户上线 / 下线"""
+        user_id = payload["user_id"]
+        if payload["online"]:
+            self.remote_users.setdefault(user_id, set()).add(source)
+        else:
+            self._remove_remote(user_id, source)
+    
+    async def _on_presence_sync(self, source: str, payload: dict, body: bytes | None):
+        """对端 worker 同步过来的全量在线用户"""
+        for user_id in payload["user_ids"]:
+            self.remote_users.setdefault(user_id, set()).add(source)
+    
+    def _remove_remote(self, user_id: int, worker_id: str):
+        workers = self.remote_users.get(user_id)
+        if workers is not None:
+            workers.discard(worker_id)
+            if not workers:
+                del self.remote_users[user_id]
+    
+    async def _on_call(self, source: str, payload: dict, body: bytes | None):
+        """其他 worker 上建立 / 结束的通话"""
+        user_id = payload["user_id"]
+        peer_id = payload["peer_id"]
+        if peer_id:
+            self.active_calls[user_id] = peer_id
+            self.active_calls[peer_id] = user_id
+            self.pending_calls.pop(user_id, None)
+            if payload.get("session_id"):
+                self.call_sessions[peer_id] = payload["session_id"]
+        else:
+            self.call_sessions.pop(user_id, None)
+            old_peer = self.active_calls.pop(user_id, None)
+            if old_peer:
+                self.active_calls.pop(old_peer, None)
+                self._stop_relay(user_id, old_peer)
+    
+    async def _on_call_session(self, source: str, payload: dict, body: bytes | None):
+        """其他 worker 上的用户选定 / 清除了通话设备"""
+        user_id = payload["user_id"]
+        if payload["session_id"] is None:
+            self.call_sessions.pop(user_id, None)
+            self.pending_calls.pop(user_id, None)
+        else:
+            self.call_sessions[user_id] = payload["session_id"]
+            if payload.get("receiver_id") is not None:
+                self.pending_calls[user_id] = payload["receiver_id"]
+    
+    async def _on_peer_joined(self, source: str, payload: dict, body: bytes | None):
+        """新 worker 加入：把本 worker 的在线用户同步给它"""
+        await self.bus.send_to(source, "presence_sync", {"user_ids": list(self.active_connections)})
+    
+    async def _on_peer_lost(self, source: str, payload: dict, body: bytes | None):
+        """worker 退出：清理其上的在线用户"""
+        lost = [uid for uid, workers in self.remote_users.items() if source in workers]
+        for user_id in lost:
+            self._remove_remote(user_id, source)
+        if lost:
+            logger.warning(f"worker {source} 已断开，移除 {len(lost)} 个远程在线用户")
 
 
 # 全局单例
@@ -0,0 +1,132 @@
+"""在线状态引擎
+
+移动端网络不稳定时会频繁断线重连，每次都写库并给所有联系人推送上线/下线，浪费严重。
+
+- 防抖：连接断开后不立即下线，等待宽限期（PRESENCE_GRACE_SECONDS），
+  期间重连则上线、下线都不发生，既不写库也不推送
+- 合并：状态变化先按接收方攒到发件箱，窗口（PRESENCE_BATCH_MS）结束后每个接收方只收一帧，
+  同一用户多次变化只保留最后一次。多个变化合并成的 user_status_batch 只发给声明了
+  caps=presence_batch 的连接，其他连接仍逐条收到 user_online / user_offline
+"""
+from typing import Dict, TYPE_CHECKING
+from app.websocket.codec import EncodedMessage
+from app.websocket.connection import CAP_PRESENCE_BATCH, encode_message
+import asyncio
+import logging
+
+if TYPE_CHECKING:
+    from app.websocket.manager import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceEngine:
+    """在线状态防抖与批量推送"""
+
+    def __init__(self, manager: "ConnectionManager", grace: float, batch_window: float):
+        self.manager = manager
+        self.grace = grace
+        self.batch_window = batch_window
+        # 等待下线的用户: {user_id: TimerHandle}
+        self._pending_offline: Dict[int, asyncio.TimerHandle] = {}
+        # 发件箱: {接收方 user_id: {状态变化的 user_id: status}}
+        self._outbox: Dict[int, Dict[int, str]] = {}
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def user_connected(self, user_id: int, db):
+        """用户建立连接：宽限期内重连不产生任何状态变化"""
+        handle = self._pending_offline.pop(user_id, None)
+        if handle:
+            handle.cancel()
+            logger.info(f"用户 {user_id} 在宽限期内重连，跳过上下线广播")
+            return
+        await self.manager.broadcast_user_status(user_id, "online", db)
+
+    def user_disconnected(self, user_id: int):
+        """用户断开连接：宽限期后仍不在线才真正下线"""
+        old = self._pending_offline.pop(user_id, None)
+        if old:
+            old.cancel()
+        loop = asyncio.get_running_loop()
+        self._pending_offline[user_id] = loop.call_later(self.grace, self._expire, user_id)
+
+    def _expire(self, user_id: int):
+        self._pending_offline.pop(user_id, None)
+        # 已在本 worker 或其他 worker 重新上线
+        if self.manager.is_online(user_id):
+            return
+        self._spawn(self._go_offline(user_id))
+
+    async def _go_offline(self, user_id: int):
+        from app.db.database import SessionLocal, run_db
+
+        db = SessionLocal()
+        try:
+            await self.manager.broadcast_user_status(user_id, "offline", db)
+        except Exception as e:
+            logger.error(f"广播用户 {user_id} 下线状态失败: {e}")
+        finally:
+            await run_db(db.close)
+
+    def notify(self, user_id: int, status: str, recipients):
+        """把 user_id 的状态变化放入各接收方的发件箱，稍后合并发送"""
+        for recipient in recipients:
+            self._outbox.setdefault(recipient, {})[user_id] = status
+        if self._outbox and self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.batch_window, self._spawn_flush)
+
+    def _spawn_flush(self):
+        self._flush_handle = None
+        self._spawn(self.flush())
+
+    async def flush(self):
+        """发送发件箱中的状态变化：变化内容相同的接收方共用一次扇出"""
+        outbox, self._outbox = self._outbox, {}
+        groups: Dict[tuple, list[int]] = {}
+        for recipient, changes in outbox.items():
+            groups.setdefault(tuple(sorted(changes.items())), []).append(recipient)
+
+        for changes, recipients in groups.items():
+            await self.manager.fanout(recipients, self._build_message(changes))
+
+    @staticmethod
+    def _build_message(changes: tuple) -> dict | EncodedMessage:
+        single = [{"type": f"user_{status}", "data": {"user_id": user_id}} for user_id, status in changes]
+        if len(single) == 1:
+            return single[0]
+        encoded = encode_message({
+            "type": "user_status_batch",
+            "data": {
+                "online": [uid for uid, status in changes if status == "online"],
+                "offline": [uid for uid, status in changes if status == "offline"]
+            }
+        })
+        encoded.requires = CAP_PRESENCE_BATCH
+        encoded.fallback = [encode_message(m) for m in single]
+        return encoded
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stop(self):
+        """取消所有等待中的定时器，等待下线和仍在线的用户直接标记为下线
+
+        在其他 worker 上仍有连接的用户不标记（需在关闭消息总线之前调用）
+        """
+        from app.services.presence_store import presence_store
+
+        for user_id, handle in self._pending_offline.items():
+            handle.cancel()
+            if user_id not in self.manager.remote_users:
+                presence_store.set_status(user_id, "offline")
+        self._pending_offline.clear()
+        for user_id in self.manager.active_connections:
+            if user_id not in self.manager.remote_users:
+                presence_store.set_status(user_id, "offline")
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
@@ -0,0 +1,90 @@
+"""语音通话音频转发
+
+每个进行中的通话有一个 CallRelay，每个方向一个固定容量的环形缓冲和一个转发协程：
+接收循环只把 receive() 拿到的 bytes 原样放进环形缓冲（不复制、不等待），
+转发协程负责发给对方。对方网络慢时缓冲写满，丢弃最旧的帧——
+实时语音宁可丢帧也不要累积延迟，接收循环和信令处理永远不会被音频拖住。
+"""
+from collections import deque
+from typing import Awaitable, Callable, Dict
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 发送函数: (目标 user_id, 音频帧) -> 是否发送成功
+AudioSender = Callable[[int, bytes], Awaitable[bool]]
+
+
+class _Direction:
+    """单向音频转发"""
+
+    def __init__(self, target_id: int, send: AudioSender, capacity: int):
+        self.target_id = target_id
+        self.send = send
+        self.frames: deque[bytes] = deque(maxlen=capacity)
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.frames_in = 0
+        self.frames_out = 0
+        self.dropped = 0
+
+    def push(self, frame: bytes):
+        if len(self.frames) == self.frames.maxlen:
+            # deque 满时 append 会自动挤掉最旧的一帧
+            self.dropped += 1
+        self.frames.append(frame)
+        self.frames_in += 1
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            while not self.frames:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            frame = self.frames.popleft()
+            if await self.send(self.target_id, frame):
+                self.frames_out += 1
+            else:
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        return {
+            "frames_in": self.frames_in,
+            "frames_out": self.frames_out,
+            "dropped": self.dropped,
+            "buffered": len(self.frames)
+        }
+
+
+class CallRelay:
+    """一通电话的双向音频转发"""
+
+    def __init__(self, user_a: int, user_b: int, send: AudioSender, capacity: int = 32):
+        # {发送方 user_id: 发往对方的方向}
+        self._directions: Dict[int, _Direction] = {
+            user_a: _Direction(user_b, send, capacity),
+            user_b: _Direction(user_a, send, capacity),
+        }
+
+    def start(self):
+        for direction in self._directions.values():
+            direction.task = asyncio.create_task(direction.run())
+
+    def push(self, sender_id: int, frame: bytes) -> bool:
+        """放入一帧来自 sender_id 的音频（同步，不等待发送）"""
+        direction = self._directions.get(sender_id)
+        if direction is None:
+            return False
+        direction.push(frame)
+        return True
+
+    def stop(self):
+        for direction in self._directions.values():
+            if direction.task and not direction.task.done():
+                direction.task.cancel()
+            direction.frames.clear()
+
+    def stats(self) -> dict:
+        """每个方向的帧计数: {发送方 user_id: {...}}"""
+        return {sender_id: d.stats() for sender_id, d in self._directions.items()}
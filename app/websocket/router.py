@@ -1,9 +1,15 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
 from app.websocket.manager import manager
-from app.core.security import verify_token
-from app.db.database import SessionLocal
+from app.websocket.connection import parse_caps
+from app.websocket.codec import FRAME_AUDIO, FRAME_EVENT
+from app.services.sync_service import stream_missed_messages
+from app.websocket.dispatcher import dispatcher, HandlerContext
+from app.websocket import handlers  # 导入即注册消息处理函数
+from app.core.diagnostics import set_label
+from app.websocket.admission import admission, reject
+from app.core.security import verify_token, create_resume_token, verify_resume_token
+from app.db.database import SessionLocal, run_db
 from jose import JWTError
-import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,19 +19,42 @@ router = APIRouter()
 @router.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
-    token: str = Query(...)
+    token: str = Query(...),
+    session_id: str | None = Query(None),
+    caps: str | None = Query(None),
+    cursor: str | None = Query(None),
+    resume: str | None = Query(None),
+    ack: int | None = Query(None, ge=0)
 ):
     """
     WebSocket连接端点
     
     Query参数:
         - token: JWT认证令牌
+        - session_id: 设备会话标识（可选，同一设备重连时带上，不传则由服务端生成）
+        - caps: 客户端能力，逗号分隔（可选）
+            batch: 接收批量帧（数组，每个元素是一条普通消息）
+            msgpack: 使用 MessagePack 二进制帧（帧格式见 app/websocket/codec.py）
+            presence_batch: 多个在线状态变化合并为一条 user_status_batch（否则逐条推送 user_online / user_offline）
+        - cursor: 离线同步游标（可选）。带上时在 connected 之后推送游标之后的离线消息
+            （sync_messages，可能多页），最后推送 sync_done，详见 app/services/sync_service.py
+        - resume: 断线重连令牌（可选，connected 消息中下发）。有效时在准入排队中走优先通道，
+            并沿用原来的 session_id
+        - ack: 重连时带上已处理的最大推送序号（可选）。new_message / new_group_message 推送带 seq，
+            客户端用 {"type": "ack", "seq": N} 累计确认；同一会话重连后服务端在 connected 之后
+            重发未确认的推送，详见 app/websocket/delivery.py
+    
+    服务器繁忙时会先发送 retry_after（建议多少秒后重连），再以 1013 关闭连接。
+    
+    同一用户可以在多台设备上同时连接，消息推送给所有设备；
+    通话音频只在发起 / 接听的那台设备上收发。
     """
     user_id = None
     db = None
+    connection = None
     
     try:
-        # 验证token
+        # 验证token（只解码签名，不查库，放在准入之前）
         payload = verify_token(token)
         user_id = payload.get("user_id")
         
@@ -33,174 +62,97 @@ async def websocket_endpoint(
             await websocket.close(code=1008, reason="Invalid token")
             return
         
+        # 准入控制：带有效且属于该用户的重连令牌的走优先通道
+        resumed = verify_resume_token(resume) if resume else None
+        if resumed and resumed["user_id"] != user_id:
+            resumed = None
+        retry_after = await admission.admit(priority=resumed is not None)
+        if retry_after is not None:
+            await reject(websocket, retry_after)
+            return
+        
+        if resumed and not session_id:
+            session_id = resumed["session_id"]
+        
         # 为WebSocket创建独立的数据库会话
         db = SessionLocal()
         
-        # 建立连接
-        await manager.connect(user_id, websocket)
+        # 建立连接（用户已在其他设备在线时不再重复广播上线）
+        was_online = manager.is_online(user_id)
+        connection = await manager.connect(user_id, websocket, session_id, parse_caps(caps))
+        session_id = connection.session_id
         
-        # 获取在线联系人列表并发送给当前用户
+        # 获取在线联系人列表并发送给当前设备
         online_contacts = await manager.get_online_contacts(user_id, db)
-        await websocket.send_text(json.dumps({
+        connection.send_message({
             "type": "online_users",
             "data": {"user_ids": online_contacts}
-        }, ensure_ascii=False))
+        })
         
-        # 广播用户上线状态给其联系人
-        await manager.broadcast_user_status(user_id, "online", db)
+        # 广播用户上线状态给其联系人（宽限期内重连不广播）
+        if not was_online:
+            await manager.presence.user_connected(user_id, db)
         
-        # 发送连接成功消息
-        await websocket.send_text(json.dumps({
+        # 发送连接成功消息（delivery: 推送确认的水位，gap 为 true 时需用同步游标补齐）
+        gap = connection.window.resume(ack)
+        connection.send_message({
             "type": "connected",
-            "data": {"user_id": user_id, "message": "连接成功"}
-        }, ensure_ascii=False))
+            "data": {
+                "user_id": user_id,
+                "session_id": session_id,
+                "caps": sorted(connection.caps),
+                "resume_token": create_resume_token(user_id, session_id),
+                "delivery": {"acked": connection.window.acked, "gap": gap},
+                "message": "连接成功"
+            }
+        })
+        
+        # 重发上次连接未确认的推送
+        resent = connection.replay_unacked()
+        if resent:
+            logger.info(f"用户 {user_id} 设备 {session_id} 重连，重发 {resent} 条未确认消息")
+        
+        # 推送离线期间错过的消息
+        if cursor is not None:
+            await stream_missed_messages(db, connection, cursor)
         
         # 保持连接，监听客户端消息
+        ctx = HandlerContext(connection, websocket, db)
         while True:
             try:
                 # 接收消息（可能是文本或二进制）
                 message_data = await websocket.receive()
+                if message_data["type"] == "websocket.disconnect":
+                    logger.info(f"用户 {user_id} 主动断开连接")
+                    break
+                connection.touch()
                 
-                # 处理二进制消息（音频流）
-                if "bytes" in message_data:
-                    audio_data = message_data["bytes"]
-                    # 转发音频数据给通话对方
-                    peer_id = manager.get_call_peer(user_id)
-                    if peer_id:
-                        await manager.send_binary_message(peer_id, audio_data)
-                    continue
+                # 处理二进制消息（音频流；msgpack 编码下也可能是信令）
+                if message_data.get("bytes") is not None:
+                    frame_type, data = connection.codec.split_binary(message_data["bytes"])
+                    if frame_type == FRAME_AUDIO:
+                        set_label("ws:audio")
+                        # 原样交给通话转发器，不等待对方发送完成
+                        manager.relay_audio(user_id, data, session_id)
+                        continue
+                    if frame_type != FRAME_EVENT:
+                        logger.warning(f"收到未知类型的二进制帧: {frame_type}")
+                        continue
+                else:
+                    data = message_data.get("text")
                 
-                # 处理文本消息（信令）
-                if "text" in message_data:
-                    data = message_data["text"]
+                # 处理信令：按 type 分发到 handlers.py 中注册的处理函数
+                if data is not None:
                     try:
-                        message = json.loads(data)
-                        msg_type = message.get("type")
-                        
-                        # 心跳检测
-                        if msg_type == "ping":
-                            await websocket.send_text(json.dumps({
-                                "type": "pong",
-                                "data": {"timestamp": message.get("timestamp")}
-                            }))
-                        
-                        # 语音通话请求
-                        elif msg_type == "voice_call_request":
-                            receiver_id = message.get("to_user_id")
-                            caller_name = message.get("caller_name")
-                            caller_avatar = message.get("caller_avatar")
-                            
-                            # 检查对方是否在线
-                            if not manager.is_online(receiver_id):
-                                await websocket.send_text(json.dumps({
-                                    "type": "voice_call_failed",
-                                    "data": {"reason": "对方不在线"}
-                                }))
-                                continue
-                            
-                            # 检查自己是否正在通话
-                            if manager.is_in_call(user_id):
-                                await websocket.send_text(json.dumps({
-                                    "type": "voice_call_failed",
-                                    "data": {"reason": "您正在通话中"}
-                                }))
-                                continue
-                            
-                            # 检查对方是否正在通话
-                            if manager.is_in_call(receiver_id):
-                                await websocket.send_text(json.dumps({
-                                    "type": "voice_call_busy",
-                                    "data": {"reason": "对方正在通话中"}
-                                }))
-                                continue
-                            
-                            # 转发通话请求给对方
-                            await manager.send_personal_message(receiver_id, {
-                                "type": "voice_call_incoming",
-                                "data": {
-                                    "caller_id": user_id,
-                                    "caller_name": caller_name,
-                                    "caller_avatar": caller_avatar
-                                }
-                            })
-                        
-                        # 接受通话
-                        elif msg_type == "voice_call_accept":
-                            caller_id = message.get("caller_id")
-                            receiver_name = message.get("receiver_name")
-                            receiver_avatar = message.get("receiver_avatar")
-                            
-                            # 检查发起方是否还在线
-                            if not manager.is_online(caller_id):
-                                await websocket.send_text(json.dumps({
-                                    "type": "voice_call_failed",
-                                    "data": {"reason": "对方已离线"}
-                                }))
-                                continue
-                            
-                            # 检查发起方是否已经在通话中（可能接了其他人的电话）
-                            if manager.is_in_call(caller_id):
-                                await websocket.send_text(json.dumps({
-                                    "type": "voice_call_failed",
-                                    "data": {"reason": "对方已在通话中"}
-                                }))
-                                continue
-                            
-                            # 建立通话映射
-                            manager.start_call(caller_id, user_id)
-                            
-                            # 通知发起方通话已接通
-                            await manager.send_personal_message(caller_id, {
-                                "type": "voice_call_connected",
-                                "data": {
-                                    "peer_id": user_id,
-                                    "peer_name": receiver_name,
-                                    "peer_avatar": receiver_avatar
-                                }
-                            })
-                            
-                            # 通知接收方通话已接通
-                            await websocket.send_text(json.dumps({
-                                "type": "voice_call_connected",
-                                "data": {
-                                    "peer_id": caller_id
-                                }
-                            }))
-                        
-                        # 拒绝通话
-                        elif msg_type == "voice_call_reject":
-                            caller_id = message.get("caller_id")
-                            
-                            # 通知发起方被拒绝
-                            await manager.send_personal_message(caller_id, {
-                                "type": "voice_call_rejected",
-                                "data": {"reason": "对方拒绝了通话"}
-                            })
-                        
-                        # 取消通话（呼叫中主动挂断）
-                        elif msg_type == "voice_call_cancel":
-                            receiver_id = message.get("receiver_id")
-                            
-                            # 通知接收方通话已取消
-                            if receiver_id:
-                                await manager.send_personal_message(receiver_id, {
-                                    "type": "voice_call_cancelled",
-                                    "data": {"reason": "对方已取消通话"}
-                                })
-                        
-                        # 挂断通话
-                        elif msg_type == "voice_call_hangup":
-                            peer_id = manager.end_call(user_id)
-                            
-                            if peer_id:
-                                # 通知对方通话已结束
-                                await manager.send_personal_message(peer_id, {
-                                    "type": "voice_call_ended",
-                                    "data": {"reason": "对方已挂断"}
-                                })
-                        
-                    except json.JSONDecodeError:
-                        logger.warning(f"收到无效JSON: {data}")
+                        message = connection.codec.decode(data)
+                    except ValueError:
+                        # 不记录内容，避免恶意或异常客户端刷日志
+                        logger.debug(f"用户 {user_id} 发送了无法解析的消息（{len(data)} 字节）")
+                        continue
+                    if not isinstance(message, dict):
+                        logger.debug(f"用户 {user_id} 发送了非对象消息")
+                        continue
+                    await dispatcher.dispatch(ctx, message)
             
             except WebSocketDisconnect:
                 logger.info(f"用户 {user_id} 主动断开连接")
@@ -217,28 +169,14 @@ async def websocket_endpoint(
     except Exception as e:
         logger.error(f"WebSocket错误: {e}")
     finally:
-        if user_id:
-            # 如果用户正在通话中，通知对方挂断
-            peer_id = manager.end_call(user_id)
-            if peer_id:
-                await manager.send_personal_message(peer_id, {
-                    "type": "voice_call_ended",
-                    "data": {"reason": "对方已断开连接"}
-                })
-            
-            # 广播用户下线状态给其联系人
-            if db:
-                try:
-                    await manager.broadcast_user_status(user_id, "offline", db)
-                except Exception as e:
-                    logger.error(f"广播下线状态失败: {e}")
-            
-            manager.disconnect(user_id)
-            logger.info(f"清理用户 {user_id} 的连接资源")
+        if connection:
+            # 挂断通话、延迟广播下线（已被心跳回收时不重复处理）
+            await manager.release(connection)
+            logger.info(f"清理用户 {user_id} 设备 {session_id} 的连接资源")
         
         # 关闭数据库会话
         if db:
             try:
-                db.close()
+                await run_db(db.close)
             except Exception as e:
                 logger.error(f"关闭数据库会话失败: {e}")
@@ -0,0 +1,132 @@
+"""WebSocket 上的请求 / 响应（RPC）
+
+客户端已经持有认证过的 /ws 连接，发消息、拉历史、标记已读等高频操作
+可以直接走这条连接，省掉每次 HTTP 请求的 JWT 解码、新建数据库会话和查询用户。
+
+请求:
+    {"type": "rpc", "id": 请求ID, "method": "send_message", "params": {...}}
+响应（只发给发起请求的这台设备，id 原样带回）:
+    {"type": "rpc_result", "id": 请求ID, "result": ...}
+    {"type": "rpc_error", "id": 请求ID, "error": {"code": 404, "message": "..."}}
+
+错误码沿用 HTTP 状态码语义：400 请求格式错误、404 方法不存在、422 参数校验失败、500 服务器错误。
+"""
+from typing import Awaitable, Callable, Dict, Optional
+from fastapi import HTTPException
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy.orm import Session
+from app.schemas.messages import MessageCreate, MessageResponse
+from app.services import messages_service as message_service
+from app.db.database import run_db
+from app.websocket.connection import Connection
+import logging
+
+logger = logging.getLogger(__name__)
+
+# RPC 方法: (db, 当前用户 id, 参数) -> 可 JSON 序列化的结果
+RpcMethod = Callable[[Session, int, dict], Awaitable[object]]
+
+_methods: Dict[str, RpcMethod] = {}
+
+
+def rpc_method(name: str):
+    """注册 RPC 方法"""
+    def decorator(func: RpcMethod) -> RpcMethod:
+        _methods[name] = func
+        return func
+    return decorator
+
+
+# ==================== 参数 ====================
+
+class HistoryParams(BaseModel):
+    peer_user_id: int
+    last_id: Optional[int] = None
+    limit: int = Field(99, ge=1, le=100)
+    before: Optional[str] = None
+    after: Optional[str] = None
+    around: Optional[int] = None
+
+
+class PeerParams(BaseModel):
+    peer_user_id: int
+
+
+class UnreadParams(BaseModel):
+    peer_user_id: Optional[int] = None
+
+
+# ==================== 方法 ====================
+
+@rpc_method("send_message")
+async def _send_message(db: Session, user_id: int, params: dict):
+    """发送私聊消息，参数同 POST /api/messages/send"""
+    message = await message_service.send_message_async(db, user_id, MessageCreate(**params))
+    return MessageResponse.model_validate(message).model_dump(mode='json')
+
+
+@rpc_method("history")
+async def _history(db: Session, user_id: int, params: dict):
+    """聊天历史，参数同 GET /api/messages/history/{peer_user_id}"""
+    p = HistoryParams(**params)
+    page = await run_db(
+        message_service.get_chat_history, db, user_id, p.peer_user_id, p.last_id, p.limit,
+        p.before, p.after, p.around
+    )
+    return page.model_dump(mode='json')
+
+
+@rpc_method("mark_read")
+async def _mark_read(db: Session, user_id: int, params: dict):
+    """标记与某人的消息为已读，参数同 POST /api/messages/read/{peer_user_id}"""
+    p = PeerParams(**params)
+    updated_count = await message_service.mark_as_read_async(db, user_id, p.peer_user_id)
+    return {"peer_user_id": p.peer_user_id, "updated_count": updated_count}
+
+
+@rpc_method("unread")
+async def _unread(db: Session, user_id: int, params: dict):
+    """未读数：带 peer_user_id 时返回与该用户的未读数，否则返回总数和按联系人聚合"""
+    p = UnreadParams(**params)
+    if p.peer_user_id is not None:
+        count = await run_db(message_service.get_unread_count, db, user_id, p.peer_user_id)
+        return {"peer_user_id": p.peer_user_id, "unread_count": count}
+    return {
+        "total": await run_db(message_service.get_total_unread_count, db, user_id),
+        "by_user": await run_db(message_service.get_unread_counts_by_user, db, user_id)
+    }
+
+
+# ==================== 分发 ====================
+
+def _error(request_id, code: int, message: str) -> dict:
+    return {"type": "rpc_error", "id": request_id, "error": {"code": code, "message": message}}
+
+
+async def handle_rpc(db: Session, connection: Connection, message: dict):
+    """处理一条 RPC 请求，结果直接发回当前连接"""
+    request_id = message.get("id")
+    method = _methods.get(message.get("method"))
+    params = message.get("params") or {}
+
+    if request_id is None or not isinstance(params, dict):
+        connection.send_message(_error(request_id, 400, "请求格式错误"))
+        return
+    if method is None:
+        connection.send_message(_error(request_id, 404, f"未知方法: {message.get('method')}"))
+        return
+
+    try:
+        result = await method(db, connection.user_id, params)
+        connection.send_message({"type": "rpc_result", "id": request_id, "result": result})
+    except ValidationError as e:
+        connection.send_message(_error(request_id, 422, str(e)))
+    except HTTPException as e:
+        connection.send_message(_error(request_id, e.status_code, str(e.detail)))
+    except Exception as e:
+        logger.error(f"用户 {connection.user_id} 调用 {message.get('method')} 失败: {e}")
+        connection.send_message(_error(request_id, 500, "服务器内部错误"))
+    finally:
+        # 连接上的会话长期存在：每次调用后结束事务，下次查询才能看到其他会话提交的数据
+        # （MySQL 默认 REPEATABLE READ，同一事务内一直读第一次查询时的快照）
+        await run_db(db.rollback)
@@ -2,10 +2,13 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from app.api import auth, user, contact, messages, groups
+from app.api import auth, user, contact, messages, groups, diagnostics
 from app.websocket import router as websocket_router
 from app.websocket.manager import manager
+from app.services.presence_store import presence_store
 from app.core.config import settings
+from app.db.database import db_executor
+from app.core.diagnostics import loop_monitor, LabelMiddleware
 import os
 import cleanup
 
@@ -28,9 +31,20 @@ async def lifespan(app: FastAPI):
             logger.error(f"数据库初始化失败: {e}")
             # 不阻止应用启动，因为表可能已经被其他worker创建
     
+    # 事件循环延迟监控
+    loop_monitor.start()
+    # 启动 WebSocket 跨 worker 消息总线
+    await manager.start()
+    # 启动在线状态批量回写
+    await presence_store.start()
+    
     yield
     # ===== 关闭阶段 =====
-    pass
+    await manager.stop()
+    # 最后一次回写在线状态
+    await presence_store.stop()
+    db_executor.shutdown(wait=False)
+    loop_monitor.stop()
 
 app = FastAPI(
     title="Chat Demo",
@@ -52,6 +66,8 @@ app.add_middleware(
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
     allow_headers=["*"],
 )
+# 为阻塞检测标记当前请求的路由
+app.add_middleware(LabelMiddleware)
 
 # 注册路由
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
@@ -59,6 +75,7 @@ app.include_router(user.router, prefix="/api/auth", tags=["User"])
 app.include_router(contact.router, prefix="/api/contacts", tags=["Contacts"])
 app.include_router(messages.router, prefix="/api/messages", tags=["Messages"])
 app.include_router(groups.router, prefix="/api/groups", tags=["Groups"])
+app.include_router(diagnostics.router, prefix="/api/diagnostics", tags=["Diagnostics"])
 app.include_router(websocket_router.router, tags=["WebSocket"])
 
 # 根路由
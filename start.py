@@ -14,6 +14,7 @@ if __name__ == "__main__":
         limit_concurrency=200,  # 增加并发限制
         limit_max_requests=5000,  # 增加最大请求数
         backlog=2048,  # 增加连接队列
+        ws_per_message_deflate=True,  # WebSocket 压缩（permessage-deflate，客户端握手时协商）
         # ↓↓↓ 新增：本地 https，证书用 mkcert 生成的
         #如果不用本地开发就注释掉下面两行
         ssl_keyfile="localhost.key",   # 私钥